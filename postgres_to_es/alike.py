@@ -0,0 +1,240 @@
+import json
+import logging
+import time
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from psycopg2.extensions import connection as _connection
+
+from config import alike_index, alike_schema
+from db_query import alike_features
+from es import EsSaver
+
+logger = logging.getLogger('Alike')
+
+DEFAULT_WEIGHTS = {'genre': 1.0, 'person': 1.0, 'rating': 0.2}
+
+
+class Incidence:
+    """Разреженная бинарная матрица фильмы x признаки в виде индексов CSR.
+
+    Хранятся и строки (признаки фильма), и столбцы (фильмы признака), чтобы
+    число общих признаков блока фильмов со всеми фильмами считалось через
+    np.bincount по парам, без матрицы фильмы x персоны целиком.
+    """
+
+    def __init__(self, values: list):
+        columns = sorted({item for items in values for item in items})
+        columns = {item: i for i, item in enumerate(columns)}
+        self.counts = np.array([len(items) for items in values], dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(self.counts)))
+        self.indices = np.fromiter((columns[item] for items in values for item in items),
+                                   dtype=np.int64, count=int(self.counts.sum()))
+        # Транспонированная матрица: фильмы каждого признака
+        rows = np.repeat(np.arange(len(values)), self.counts)
+        order = np.argsort(self.indices, kind='stable')
+        self.column_films = rows[order]
+        sizes = np.bincount(self.indices, minlength=len(columns))
+        self.column_ptr = np.concatenate(([0], np.cumsum(sizes)))
+
+    def shared(self, films: np.ndarray) -> np.ndarray:
+        """Число общих признаков каждого из films с каждым фильмом, len(films) x N"""
+        n = len(self.counts)
+        block_rows = np.repeat(np.arange(len(films)), self.counts[films])
+        items = self.indices[ranges(self.indptr[films], self.counts[films])]
+        sizes = self.column_ptr[items + 1] - self.column_ptr[items]
+        rows = np.repeat(block_rows, sizes)
+        cols = self.column_films[ranges(self.column_ptr[items], sizes)]
+        shared = np.bincount(rows * n + cols, minlength=len(films) * n)
+        return shared.reshape(len(films), n).astype(np.float32)
+
+
+def ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Склеенные диапазоны [start, start + count) без цикла по ним"""
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(counts.sum())
+
+
+class FilmFeatures:
+    """Признаки всех фильмов каталога для расчёта близости.
+
+    Жанров мало, они лежат плотной матрицей; персон много, они хранятся
+    разреженно (Incidence). Обе части нормированы по числу признаков фильма,
+    так что их близость - косинусная.
+    """
+
+    def __init__(self, rows: Iterable):
+        rows = sorted(rows, key=lambda row: str(row['id']))
+        self.ids = [str(row['id']) for row in rows]
+        self.position = {film_id: i for i, film_id in enumerate(self.ids)}
+        genres = [sorted(set(row['genre_ids'] or ())) for row in rows]
+        persons = [sorted(set(row['person_ids'] or ())) for row in rows]
+        self.summaries = [
+            {'id': film_id, 'title': row['title'], 'imdb_rating': row['rating']}
+            for film_id, row in zip(self.ids, rows)
+        ]
+        self.signatures = [
+            (row['title'], row['rating'], tuple(genre_ids), tuple(person_ids))
+            for row, genre_ids, person_ids in zip(rows, genres, persons)
+        ]
+        self.rating = np.array(
+            [np.nan if row['rating'] is None else row['rating'] for row in rows],
+            dtype=np.float32,
+        )
+        incidence = Incidence(genres)
+        self.genres = np.zeros((len(rows), len(incidence.column_ptr) - 1), dtype=np.float32)
+        self.genres[np.repeat(np.arange(len(rows)), incidence.counts), incidence.indices] = 1
+        self.genres /= np.sqrt(np.maximum(incidence.counts, 1))[:, None]
+        self.persons = Incidence(persons)
+        self.person_norms = np.sqrt(np.maximum(self.persons.counts, 1)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def score(self, films: np.ndarray, weights: dict) -> np.ndarray:
+        """Близость фильмов films ко всем фильмам каталога, len(films) x N.
+
+        Близость симметрична, поэтому столбец j - это и близость фильма j
+        к каждому из films. Сам с собой фильм получает -inf. Значения
+        округляются, чтобы ничьи не зависели от формы блока при умножении.
+        """
+        scores = weights['genre'] * (self.genres[films] @ self.genres.T)
+        persons = self.persons.shared(films)
+        persons /= self.person_norms[films, None] * self.person_norms[None, :]
+        scores += weights['person'] * persons
+        rating = 1 - np.abs(self.rating[films, None] - self.rating[None, :]) / 10
+        scores += weights['rating'] * np.nan_to_num(rating, nan=0)
+        scores = np.round(scores, 5)
+        scores[np.arange(len(films)), films] = -np.inf
+        return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple:
+    """Индексы и значения k лучших в каждой строке, по убыванию близости.
+
+    При равной близости выше фильм с меньшим индексом: score округляет
+    значения до 1e-5, и поправка на индекс меньше этого шага не меняет
+    порядок разных значений, но однозначно разводит равные.
+    """
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(int), empty
+    keys = scores.astype(np.float64) - np.arange(scores.shape[1]) * (1e-6 / scores.shape[1])
+    best = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(keys, best, axis=1), axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    return best, np.take_along_axis(scores, best, axis=1)
+
+
+def blocks(films: Iterable[int], size: int) -> Iterator[np.ndarray]:
+    films = np.fromiter(films, dtype=int)
+    for start in range(0, len(films), size):
+        yield films[start:start + size]
+
+
+class AlikeIndex:
+    """Топ-k похожих фильмов для каждого фильма каталога.
+
+    Первый вызов update считает все списки. Дальше пересчитываются только
+    фильмы, чьи признаки изменились, фильмы, в списках которых они или
+    удалённые фильмы были, и фильмы, куда изменившийся фильм теперь входит
+    ближе k-го места. Остальные списки от изменений не зависят.
+    Близость считается блоками по block_size строк, чтобы память на матрицу
+    близости была block_size x N, а не N x N.
+    """
+
+    def __init__(self, k: int = 10, weights: Optional[dict] = None,
+                 block_size: int = 256):
+        self.k = k
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self) -> None:
+        self.signatures = {}
+        self.scores = {}
+        self.docs = {}
+
+    def update(self, rows: Iterable) -> tuple:
+        """Пересчитывает списки по строкам alike_features.
+
+        Возвращает документы, которые изменились, и id исчезнувших фильмов.
+        """
+        start = time.monotonic()
+        features = FilmFeatures(rows)
+        removed = set(self.docs) - set(features.ids)
+        if not self.docs:
+            affected = set(range(len(features)))
+        else:
+            affected = self._affected(features, removed)
+
+        docs = []
+        for block in blocks(sorted(affected), self.block_size):
+            best, values = top_k(features.score(block, self.weights), self.k)
+            for film, alike, scores in zip(block, best, values):
+                film_id = features.ids[film]
+                doc = {'id': film_id, 'films': [features.summaries[j] for j in alike]}
+                self.scores[film_id] = scores
+                if doc != self.docs.get(film_id):
+                    self.docs[film_id] = doc
+                    docs.append(doc)
+        for film_id in removed:
+            del self.docs[film_id]
+            del self.scores[film_id]
+        self.signatures = dict(zip(features.ids, features.signatures))
+        logger.info(f'Похожие фильмы: пересчитано {len(affected)} из {len(features)}, '
+                    f'изменилось {len(docs)}, удалено {len(removed)}, '
+                    f'{time.monotonic() - start:.2f} с')
+        return docs, removed
+
+    def _affected(self, features: FilmFeatures, removed: set) -> set:
+        changed = [
+            film for film, film_id in enumerate(features.ids)
+            if self.signatures.get(film_id) != features.signatures[film]
+        ]
+        stale = {features.ids[film] for film in changed} | removed
+        affected = set(changed)
+        for film_id, doc in self.docs.items():
+            if film_id in features.position and any(f['id'] in stale for f in doc['films']):
+                affected.add(features.position[film_id])
+        if not changed:
+            return affected
+
+        # Близость k-го в текущем списке; короткий список примет любой фильм.
+        # Равная близость тоже в счёт: при ничьей выше фильм с меньшим индексом
+        kth = np.full(len(features), -np.inf, dtype=np.float32)
+        for film_id, scores in self.scores.items():
+            if film_id in features.position and len(scores) >= min(self.k, len(features) - 1):
+                kth[features.position[film_id]] = scores[-1]
+        for block in blocks(changed, self.block_size):
+            best = features.score(block, self.weights).max(axis=0)
+            affected.update(np.flatnonzero(best >= kth).tolist())
+        return affected
+
+
+def write_alike(saver: EsSaver, docs: list, removed: Iterable[str]) -> int:
+    """Записывает изменившиеся списки в индекс похожих и удаляет лишние"""
+    if not saver.client.indices.exists(index=alike_index):
+        with open(alike_schema) as f:
+            saver.client.indices.create(index=alike_index, body=json.load(f))
+    written = saver.load([docs], alike_index) if docs else 0
+    if removed:
+        saver.delete(removed, alike_index)
+    return written
+
+
+def sync_alike(pg_conn: _connection, saver: EsSaver, alike: AlikeIndex) -> int:
+    """Обновляет похожие фильмы по текущему каталогу в Postgres.
+
+    Если запись не удалась, alike сбрасывается, и следующий вызов
+    пересчитает и перезапишет все списки.
+    """
+    with pg_conn.cursor() as cursor:
+        cursor.execute(alike_features)
+        rows = cursor.fetchall()
+    try:
+        return write_alike(saver, *alike.update(rows))
+    except Exception:
+        alike.reset()
+        raise
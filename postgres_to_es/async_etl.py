@@ -0,0 +1,456 @@
+import asyncio
+import json
+import logging
+import re
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Optional
+
+import asyncpg
+from elasticsearch import AsyncElasticsearch
+
+from alike import AlikeIndex, write_alike
+from config import (alike_size, alike_weights, batch_size, dsl, es_bulk,
+                    es_conf, es_force_merge, es_keep_versions, es_schemas,
+                    etl_buffer_size, etl_transform_workers, full_reload,
+                    itersize, state_file)
+from db_query import alike_features, film_texts, marks_query
+from embedding import (TextEmbedder, current_embedder, fit_embedder,
+                       publish_embedder, saved_embedder)
+from es import EsSaver, IndexValidationError, parse_bulk, report
+from load_data import LOADERS, embed, get_transform_pool, transform_ndjson
+from pipeline import Batch
+from postgresloader import NO_MARK, START_POSITION
+from state import JsonFileStorage, State
+
+logger = logging.getLogger('AsyncETL')
+
+PARAM = re.compile(r'%\((\w+)\)s')
+
+
+@lru_cache()
+def to_asyncpg(query: str) -> tuple:
+    """Переводит параметры psycopg2 %(name)s в позиционные $n asyncpg.
+
+    Возвращает текст запроса и имена параметров в порядке номеров,
+    поэтому asyncpg выполняет те же запросы из db_query.
+    """
+    names = []
+
+    def number(match: re.Match) -> str:
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f'${names.index(match.group(1)) + 1}'
+
+    return PARAM.sub(number, query), tuple(names)
+
+
+def to_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Отметка из состояния в datetime: asyncpg не принимает строки для timestamp"""
+    if value is None:
+        return None
+    if value == '-infinity':
+        return datetime.min
+    return datetime.fromisoformat(value)
+
+
+async def init_connection(conn: asyncpg.Connection) -> None:
+    # jsonb и uuid приходят в том же виде, что и из psycopg2
+    await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads,
+                              schema='pg_catalog')
+    await conn.set_type_codec('uuid', encoder=str, decoder=str,
+                              schema='pg_catalog', format='text')
+
+
+def create_pool() -> asyncpg.pool.Pool:
+    return asyncpg.create_pool(
+        database=dsl['dbname'],
+        user=dsl['user'],
+        password=dsl['password'],
+        host=dsl['host'],
+        port=dsl['port'],
+        init=init_connection,
+    )
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+_DONE = object()
+
+
+async def staged(source: AsyncIterator, maxsize: int = 4) -> AsyncIterator:
+    """Асинхронный аналог pipeline.buffered: источник работает в своей задаче.
+
+    Между стадиями стоит asyncio.Queue на maxsize элементов, поэтому
+    чтение следующей пачки идёт, пока предыдущая пишется в ES.
+    """
+    queue = asyncio.Queue(maxsize)
+
+    async def produce() -> None:
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as exc:
+            await queue.put(_Failure(exc))
+        else:
+            await queue.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        producer.cancel()
+
+
+class AsyncLoader:
+    """Выборка документов индекса через asyncpg.
+
+    Запросы, источники и transform берутся у загрузчика из postgresloader,
+    так что документы и отметки совпадают с синхронным ETL.
+    """
+
+    def __init__(self, pool: asyncpg.pool.Pool, name_index: str,
+                 batch_size: int = 100, itersize: int = 2000):
+        self.pool = pool
+        self.loader = LOADERS[name_index]
+        self.batch_size = batch_size
+        self.itersize = itersize
+        # Соединение снимка (см. snapshot), иначе запросы идут через пул
+        self.conn: Optional[asyncpg.Connection] = None
+
+    async def fetch(self, query: str, params: Optional[dict] = None) -> list:
+        sql, names = to_asyncpg(query)
+        return await (self.conn or self.pool).fetch(sql, *((params or {})[name] for name in names))
+
+    @asynccontextmanager
+    async def snapshot(self) -> AsyncIterator[None]:
+        """Как postgresloader.snapshot: запросы fetch внутри блока идут одним
+        соединением в транзакции REPEATABLE READ и видят один снимок базы
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                self.conn = conn
+                try:
+                    yield
+                finally:
+                    self.conn = None
+
+    async def extract_chunks(self, after: Optional[list] = None) -> AsyncIterator[Batch]:
+        """Полная выгрузка ключевой пагинацией, как PostgresLoader.extract_chunks"""
+        position = after or START_POSITION
+        while True:
+            rows = await self.fetch(self.loader.chunk_query, {
+                'updated_at': to_timestamp(position[0]),
+                'id': position[1],
+                'limit': self.batch_size,
+            })
+            if not rows:
+                return
+            position = [rows[-1]['updated_at'].isoformat(), rows[-1]['id']]
+            yield Batch(rows, position)
+            if len(rows) < self.batch_size:
+                return
+
+    async def extract_ids(self, ids: list) -> AsyncIterator[Batch]:
+        """Документы по id: серверный курсор отдаёт строки порциями по itersize"""
+        sql, _ = to_asyncpg(self.loader.by_ids_query)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                batch = Batch()
+                async for row in conn.cursor(sql, ids, prefetch=self.itersize):
+                    batch.append(row)
+                    if len(batch) == self.batch_size:
+                        yield batch
+                        batch = Batch()
+                if batch:
+                    yield batch
+
+    async def marks(self) -> dict:
+        row = (await self.fetch(marks_query))[0]
+        return {
+            table: row[table].isoformat() if row[table] else NO_MARK
+            for table in self.loader.sources
+        }
+
+    async def changed_ids(self, since: dict, until: dict) -> list:
+        params = {}
+        for table in self.loader.sources:
+            params[table] = to_timestamp(since[table] or NO_MARK)
+            params[f'{table}_until'] = to_timestamp(until[table])
+        return [row[0] for row in await self.fetch(self.loader.changed_query, params)]
+
+    async def count(self) -> int:
+        query = self.loader.full_query.strip().rstrip(';')
+        return (await self.fetch(f'SELECT COUNT(*) FROM ({query}) AS q'))[0][0]
+
+    async def load(self, index: str, ids: Optional[list] = None,
+                   after: Optional[list] = None,
+                   embedder: Optional[TextEmbedder] = None) -> AsyncIterator[Batch]:
+        """Аналог load_data.load_from_postgres: пачки строк bulk-запроса для index.
+
+        Чтение и преобразование идут стадиями. С ETL_TRANSFORM_WORKERS пачки
+        преобразуются в пуле процессов, до etl_transform_workers сразу,
+        а результаты забираются по порядку.
+        """
+        rows = self.extract_chunks(after) if ids is None else self.extract_ids(ids)
+        pool = get_transform_pool()
+        if embedder is None and self.loader.text_embedding:
+            embedder = current_embedder()
+
+        async def transform() -> AsyncIterator[Batch]:
+            loop = asyncio.get_running_loop()
+            pending = deque()
+            async for batch in staged(rows, etl_buffer_size):
+                if embedder is not None:
+                    batch = embed(embedder, batch)
+                if pool is None:
+                    yield transform_ndjson(self.loader.transform, index, batch)
+                    continue
+                # Record из asyncpg не сериализуется pickle, в пул уходят словари
+                batch = Batch(map(dict, batch), batch.position)
+                pending.append(loop.run_in_executor(
+                    pool, transform_ndjson, self.loader.transform, index, batch))
+                if len(pending) >= etl_transform_workers:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+
+        async for batch in staged(transform(), etl_buffer_size):
+            yield batch
+
+
+class AsyncEsSaver:
+    """Запись в Elasticsearch через AsyncElasticsearch.
+
+    Строки из to_ndjson складываются в запросы по chunk_size штук или
+    max_chunk_bytes байт, одновременно в полёте до thread_count запросов.
+    Редкие операции с индексами (создание, настройки, алиасы) выполняет
+    синхронный EsSaver в отдельном потоке.
+    """
+
+    def __init__(self, host: list, chunk_size: int = 500,
+                 max_chunk_bytes: int = 10 * 1024 * 1024,
+                 thread_count: int = 4, max_retries: int = 3):
+        self.client = AsyncElasticsearch(host)
+        self.admin = EsSaver(host, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                             thread_count=thread_count, max_retries=max_retries)
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.thread_count = thread_count
+        self.max_retries = max_retries
+
+    async def load_ndjson(self, batches: AsyncIterator[list], name_index: str,
+                          on_batch: Optional[Callable[[list], None]] = None) -> int:
+        """Пишет пачки строк из to_ndjson, см. EsSaver.load_ndjson.
+
+        Запросы завершаются в порядке отправки, поэтому on_batch вызывается
+        по порядку, когда пачка и все пачки до неё приняты кластером.
+        """
+        start = time.monotonic()
+        in_flight = deque()
+        chunk, size, waiting = [], 0, []
+        indexed, failed = 0, 0
+
+        async def complete_oldest() -> None:
+            nonlocal indexed, failed
+            task, finished = in_flight.popleft()
+            ok, errors = await task
+            indexed += ok
+            failed += errors
+            if on_batch is not None:
+                for batch in finished:
+                    on_batch(batch)
+
+        async def flush() -> None:
+            nonlocal chunk, size, waiting
+            if len(in_flight) >= self.thread_count:
+                await complete_oldest()
+            task = asyncio.create_task(self._send(chunk, name_index))
+            in_flight.append((task, waiting))
+            chunk, size, waiting = [], 0, []
+
+        try:
+            async for batch in batches:
+                for line in batch:
+                    chunk.append(line)
+                    size += len(line[1])
+                    if len(chunk) >= self.chunk_size or size >= self.max_chunk_bytes:
+                        await flush()
+                # Пачка подтверждена вместе с запросом, где её последний документ
+                waiting.append(batch)
+            if chunk:
+                await flush()
+            while in_flight:
+                await complete_oldest()
+            if waiting and on_batch is not None:
+                for batch in waiting:
+                    on_batch(batch)
+        finally:
+            for task, _ in in_flight:
+                task.cancel()
+
+        await self.client.indices.refresh(index=name_index)
+        report(name_index, indexed, failed, start)
+        return indexed
+
+    async def _send(self, chunk: list, name_index: str) -> tuple:
+        """Один bulk-запрос; отклонённые с 429 документы повторяются с паузой"""
+        indexed, failed = 0, 0
+        for attempt in range(self.max_retries + 1):
+            response = await self.client.bulk(body=b''.join(line for _, line in chunk))
+            ok, errors, chunk = parse_bulk(chunk, response, name_index,
+                                           retry=attempt < self.max_retries)
+            indexed += ok
+            failed += errors
+            if not chunk:
+                break
+            logger.warning(f'Кластер отклонил {len(chunk)} документов, повторяем')
+            await asyncio.sleep(min(2 ** attempt, 30))
+        return indexed, failed
+
+    @asynccontextmanager
+    async def bulk_mode(self, name_index: str, state: Optional[State] = None,
+                        force_merge: bool = False) -> AsyncIterator[None]:
+        mode = self.admin.bulk_mode(name_index, state, force_merge=force_merge)
+        await asyncio.to_thread(mode.__enter__)
+        try:
+            yield
+        except BaseException:
+            if not await asyncio.to_thread(mode.__exit__, *sys.exc_info()):
+                raise
+        else:
+            await asyncio.to_thread(mode.__exit__, None, None, None)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+async def rebuild_index(pool: asyncpg.pool.Pool, saver: AsyncEsSaver,
+                        name_index: str, state: State) -> int:
+    """Асинхронный вариант load_data.rebuild_index с теми же ключами состояния"""
+    key = f'rebuild_{name_index}'
+    admin = saver.admin
+    progress = state.get_state(key)
+    resumed = bool(progress) and await asyncio.to_thread(admin.client.indices.exists,
+                                                         index=progress['index'])
+    if resumed:
+        index, after = progress['index'], progress['position']
+        logger.info(f'{index}: продолжаем пересборку после {after}')
+    else:
+        with open(es_schemas[name_index]) as f:
+            index, after = await asyncio.to_thread(admin.create_index, name_index, json.load(f)), None
+        state.set_state(key, {'index': index, 'position': None})
+
+    def checkpoint(batch: Batch) -> None:
+        state.set_state(key, {'index': index, 'position': batch.position})
+
+    loader = AsyncLoader(pool, name_index, batch_size[name_index], itersize)
+    async with loader.snapshot():
+        expected = await loader.count()
+        embedder = None
+        if loader.loader.text_embedding:
+            embedder = saved_embedder(index) if resumed else None
+            if embedder is None:
+                rows = await loader.fetch(film_texts)
+                embedder = await asyncio.to_thread(fit_embedder, index, rows)
+
+        async with saver.bulk_mode(index, state, force_merge=es_force_merge):
+            loaded = await saver.load_ndjson(loader.load(index, after=after, embedder=embedder),
+                                             name_index=index, on_batch=checkpoint)
+
+    actual = await asyncio.to_thread(admin.count, index)
+    state.set_state(key, None)
+    if expected != actual:
+        await asyncio.to_thread(admin.client.indices.delete, index=index, ignore=404)
+        raise IndexValidationError(
+            f'{index}: в Postgres {expected} записей, в индексе {actual}'
+        )
+    if embedder is not None:
+        await asyncio.to_thread(publish_embedder, admin, embedder, index)
+    await asyncio.to_thread(admin.swap_alias, name_index, index, keep=es_keep_versions)
+    return loaded
+
+
+async def remove_deleted(pool: asyncpg.pool.Pool, saver: AsyncEsSaver,
+                         name_index: str) -> int:
+    """Асинхронный вариант load_data.remove_deleted"""
+    admin = saver.admin
+    loader = AsyncLoader(pool, name_index)
+    query = loader.loader.ids_query
+    expected = (await loader.fetch(f'SELECT COUNT(*) FROM ({query}) AS q'))[0][0]
+    if await asyncio.to_thread(admin.count, name_index) <= expected:
+        return 0
+    present = {str(row[0]) for row in await loader.fetch(query)}
+
+    def delete() -> int:
+        return admin.delete([doc_id for doc_id in admin.ids(name_index) if doc_id not in present],
+                            name_index)
+
+    deleted = await asyncio.to_thread(delete)
+    logger.info(f'{name_index}: удалено документов {deleted}')
+    return deleted
+
+
+async def sync_index(pool: asyncpg.pool.Pool, saver: AsyncEsSaver,
+                     name_index: str, state: State, full: bool = False) -> int:
+    """Асинхронный вариант load_data.sync_index с теми же отметками в state"""
+    loader = AsyncLoader(pool, name_index, batch_size[name_index], itersize)
+    until = await loader.marks()
+    since = state.get_state(name_index)
+    indexed = 0
+    if loader.loader.text_embedding and current_embedder() is None:
+        full = True
+    if full or not since or any(table not in since for table in until):
+        indexed = await rebuild_index(pool, saver, name_index, state)
+    else:
+        ids = await loader.changed_ids(since, until)
+        logger.info(f'{name_index}: изменилось документов {len(ids)}')
+        if ids:
+            indexed = await saver.load_ndjson(loader.load(name_index, ids), name_index=name_index)
+        await remove_deleted(pool, saver, name_index)
+    state.set_state(name_index, until)
+    return indexed
+
+
+async def main(state: State, full: bool = False) -> dict:
+    """Синхронизирует все индексы одновременно, каждый своим конвейером"""
+    start = time.monotonic()
+    saver = AsyncEsSaver(es_conf, **es_bulk)
+    async with create_pool() as pool:
+        try:
+            tasks = [asyncio.create_task(sync_index(pool, saver, name_index, state, full=full))
+                     for name_index in LOADERS]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                # Остальные конвейеры отменяются и дожидаются здесь, а не
+                # продолжают работать с уже закрытыми пулом и клиентом ES
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            rows = await pool.fetch(alike_features)
+            docs, removed = AlikeIndex(alike_size, alike_weights).update(rows)
+            await asyncio.to_thread(write_alike, saver.admin, docs, removed)
+        finally:
+            await saver.close()
+    indexed = dict(zip(LOADERS, results))
+    logger.info(f'Асинхронный ETL: {indexed}, {time.monotonic() - start:.2f} с')
+    return indexed
+
+
+if __name__ == '__main__':
+    asyncio.run(main(State(JsonFileStorage(state_file)), full=full_reload))
@@ -0,0 +1,82 @@
+"""Time to recompute alike films for the whole catalogue and after small edits.
+
+The catalogue from Postgres (.env, dump.sql) is measured as is, then
+synthetic catalogues of growing size with the same shape: a handful of
+genres per film and a cast drawn from a pool with a long tail of one-film
+persons. Each size reports the full recompute and an incremental update
+after a rating edit on 1% of films.
+
+Run from ``postgres_to_es``: ``python -m benchmarks.alike [sizes...]``.
+"""
+import random
+import statistics
+import sys
+import time
+from contextlib import closing
+
+import psycopg2
+from psycopg2.extras import DictCursor
+
+from alike import AlikeIndex
+from config import alike_size, alike_weights, dsl
+from db_query import alike_features
+
+ROUNDS = 3
+SIZES = (10_000, 50_000)
+EDITED = 0.01
+
+
+def catalogue(size: int, seed: int = 0) -> list:
+    rand = random.Random(seed)
+    genres = [f'genre-{i}' for i in range(30)]
+    persons = [f'person-{i}' for i in range(size * 3)]
+    return [{
+        'id': f'film-{i}',
+        'title': f'Film {i}',
+        'rating': round(rand.uniform(1, 10), 1),
+        'genre_ids': rand.sample(genres, rand.randint(1, 4)),
+        # Квадрат смещает выбор к началу пула: есть и звёзды, и эпизодники
+        'person_ids': [persons[int(len(persons) * rand.random() ** 2)]
+                       for _ in range(rand.randint(3, 15))],
+    } for i in range(size)]
+
+
+def edit(rows: list, share: float, seed: int) -> list:
+    rand = random.Random(seed)
+    rows = [dict(row) for row in rows]
+    for row in rand.sample(rows, max(1, int(len(rows) * share))):
+        row['rating'] = round(rand.uniform(1, 10), 1)
+    return rows
+
+
+def measure(name: str, rows: list) -> None:
+    full, incremental, recomputed = [], [], []
+    for seed in range(ROUNDS):
+        alike = AlikeIndex(alike_size, alike_weights)
+        start = time.monotonic()
+        alike.update(rows)
+        full.append(time.monotonic() - start)
+
+        start = time.monotonic()
+        docs, _ = alike.update(edit(rows, EDITED, seed))
+        incremental.append(time.monotonic() - start)
+        recomputed.append(len(docs))
+    print(f'{name:>22}: full {statistics.median(full):8.2f} s, '
+          f'{EDITED:.0%} edited {statistics.median(incremental):8.2f} s '
+          f'({statistics.median(recomputed):,.0f} lists rewritten)')
+
+
+def main(sizes: tuple = SIZES):
+    try:
+        with closing(psycopg2.connect(**dsl, cursor_factory=DictCursor)) as conn, \
+                conn.cursor() as cursor:
+            cursor.execute(alike_features)
+            measure(f'dump.sql, {cursor.rowcount} films', cursor.fetchall())
+    except psycopg2.OperationalError:
+        print('Postgres is not available, synthetic catalogues only')
+    for size in sizes:
+        measure(f'synthetic, {size:,} films', catalogue(size))
+
+
+if __name__ == '__main__':
+    main(tuple(int(size) for size in sys.argv[1:]) or SIZES)
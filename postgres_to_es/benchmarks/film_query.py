@@ -0,0 +1,112 @@
+"""EXPLAIN ANALYZE of the film aggregation query, before and after the rewrite.
+
+The old query joins person_film_work, person, genre_film_work and genre at
+once, so every film produces persons x genres rows before GROUP BY and
+DISTINCT fold them back. The new one aggregates persons and genres per film
+in separate grouped subqueries for the full load and in LATERAL
+subqueries for batches of ids.
+
+Needs the Postgres from .env loaded with dump.sql (and sql/etl_indexes.sql).
+Run from ``postgres_to_es``: ``python -m benchmarks.film_query``.
+"""
+import json
+import statistics
+from contextlib import closing
+
+import psycopg2
+
+from config import dsl
+from db_query import film_by_ids, full_load
+
+ROUNDS = 5
+BATCH = 100
+
+# Запрос до переписывания, для сравнения
+old_big_request = """ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) AS genre,
+ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'director') AS director,
+ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'actor') AS actors,
+ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'writer') AS writers,
+ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor') AS actors_names,
+ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names"""
+
+old_query = f'''SELECT DISTINCT fw.id, fw.title, fw.description, fw.rating, fw.type,
+                          fw.updated_at, {old_big_request}
+                            FROM content.film_work as fw
+                            LEFT JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
+                            LEFT JOIN content.person as p ON p.id = pfw.person_id
+                            LEFT JOIN content.genre_film_work as gfw ON gfw.film_work_id = fw.id
+                            LEFT JOIN content.genre as g ON g.id = gfw.genre_id
+                            WHERE fw.id IN (%s)
+                            GROUP BY fw.id
+                            ORDER BY fw.updated_at'''
+
+old_full_load = old_query % '''SELECT DISTINCT fw.id
+                    FROM content.film_work as fw
+                    LEFT JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
+                    WHERE pfw.person_id IN (SELECT DISTINCT id FROM content.person GROUP BY id)
+                    GROUP BY fw.id'''
+
+old_by_ids = old_query % 'SELECT UNNEST(%(ids)s::uuid[])'
+
+
+def walk(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+
+def explain(cursor, query: str, params: dict) -> dict:
+    times, plan = [], None
+    for _ in range(ROUNDS):
+        cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}', params)
+        result = cursor.fetchone()[0]
+        result = result[0] if isinstance(result, list) else json.loads(result)[0]
+        times.append(result['Execution Time'])
+        plan = result['Plan']
+    nodes = list(walk(plan))
+    return {
+        'ms': statistics.median(times),
+        'rows': sum(node['Actual Rows'] * node['Actual Loops'] for node in nodes),
+        'peak': max(node['Actual Rows'] * node['Actual Loops'] for node in nodes),
+        # Буферы корневого узла включают буферы всего плана
+        'buffers': plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+    }
+
+
+def rows(cursor, query: str, params: dict) -> list:
+    """Результат без порядка внутри одинаковых updated_at; пустые жанры как NULL"""
+    cursor.execute(query, params)
+    result = []
+    for row in cursor.fetchall():
+        row = list(row)
+        if row[6] == [{'id': None, 'name': None}]:
+            row[6] = None
+        result.append(row)
+    return sorted(result, key=lambda row: row[0])
+
+
+def report(name: str, before: dict, after: dict) -> None:
+    print(f'{name}')
+    for key, unit in (('ms', 'ms'), ('rows', 'rows through plan'),
+                      ('peak', 'rows in largest node'), ('buffers', 'buffers')):
+        ratio = before[key] / after[key] if after[key] else float('inf')
+        print(f'{unit:>22}: {before[key]:12,.1f} -> {after[key]:12,.1f}  ({ratio:.1f}x)')
+
+
+def main():
+    with closing(psycopg2.connect(**dsl)) as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT id FROM content.film_work ORDER BY updated_at LIMIT %(n)s',
+                       {'n': BATCH})
+        batch = {'ids': [row[0] for row in cursor.fetchall()]}
+
+        for name, old, new, params in (
+                ('full load', old_full_load, full_load, {}),
+                (f'batch of {BATCH} ids', old_by_ids, film_by_ids, batch),
+        ):
+            assert rows(cursor, old, params) == rows(cursor, new, params), \
+                f'{name}: results differ'
+            report(name, explain(cursor, old, params), explain(cursor, new, params))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import logging
+import select
+import threading
+import time
+from typing import Iterator, Optional
+
+import psycopg2
+from psycopg2.extensions import connection as _connection
+from psycopg2.extras import DictCursor
+
+from config import dsl
+from db_query import (change_log_ack, change_log_query, films_by_genre,
+                      films_by_person, persons_by_film)
+from es import EsSaver
+from load_data import load_from_postgres
+
+logger = logging.getLogger('ChangeFeed')
+
+CHANNEL = 'content_changes'
+
+
+class ChangeFeed:
+    """Переиндексация по ленте изменений из sql/etl_change_feed.sql.
+
+    NOTIFY только будит ленту; после него она ждёт, пока поток изменений
+    не стихнет на coalesce_delay (но не дольше max_delay), и переносит всю
+    накопленную пачку разом. Без уведомлений таблица всё равно проверяется
+    раз в idle_timeout секунд - на случай, если ETL был остановлен.
+    """
+
+    def __init__(self, pg_conn: Optional[_connection], saver: EsSaver,
+                 coalesce_delay: float = 0.5, max_delay: float = 5,
+                 batch_size: int = 1000, idle_timeout: float = 30):
+        self.conn = pg_conn
+        self.saver = saver
+        self.coalesce_delay = coalesce_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+
+        self.batches = 0
+        self.changes = 0
+        self.docs = 0
+        self.deleted = 0
+
+    def collect(self) -> tuple:
+        """Читает пачку ленты: id её записей и id документов по индексам"""
+        with self.conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute(change_log_query, {'limit': self.batch_size})
+            rows = cursor.fetchall()
+
+        changed = {'movies': set(), 'genre': set(), 'person': set()}
+        films, persons, genres = set(), set(), set()
+        for row in rows:
+            table, ids = row['table_name'], row['ids']
+            if table == 'film_work':
+                changed['movies'].add(ids['id'])
+                films.add(ids['id'])
+            elif table == 'person':
+                changed['person'].add(ids['id'])
+                persons.add(ids['id'])
+            elif table == 'genre':
+                changed['genre'].add(ids['id'])
+                genres.add(ids['id'])
+            elif table == 'person_film_work':
+                changed['movies'].add(ids['film_work_id'])
+                changed['person'].add(ids['person_id'])
+            elif table == 'genre_film_work':
+                changed['movies'].add(ids['film_work_id'])
+
+        # Имена персон и жанров встроены в документы фильмов,
+        # а названия и рейтинги фильмов - в документы персон
+        with self.conn.cursor() as cursor:
+            for query, ids, name_index in ((films_by_person, persons, 'movies'),
+                                           (films_by_genre, genres, 'movies'),
+                                           (persons_by_film, films, 'person')):
+                if ids:
+                    cursor.execute(query, {'ids': list(ids)})
+                    changed[name_index].update(str(row[0]) for row in cursor)
+        return [row['id'] for row in rows], changed
+
+    def apply(self, changed: dict) -> int:
+        """Перезаписывает документы; тех, что исчезли из Postgres, удаляет"""
+        indexed = 0
+        for name_index, ids in changed.items():
+            if not ids:
+                continue
+            found = set()
+            batches = load_from_postgres(self.conn, name_index, list(ids))
+            indexed += self.saver.load(self._track(batches, found), name_index)
+            if ids - found:
+                self.deleted += self.saver.delete(ids - found, name_index)
+        return indexed
+
+    def acknowledge(self, log_ids: list) -> None:
+        with self.conn.cursor() as cursor:
+            cursor.execute(change_log_ack, {'ids': log_ids})
+        self.conn.commit()
+
+    def drain(self) -> int:
+        """Обрабатывает ленту пачками, пока она не опустеет"""
+        indexed = 0
+        while True:
+            log_ids, changed = self.collect()
+            if not log_ids:
+                self.conn.commit()
+                return indexed
+            indexed += self.apply(changed)
+            self.acknowledge(log_ids)
+            self.batches += 1
+            self.changes += len(log_ids)
+            logger.info(f'Лента: {len(log_ids)} изменений, '
+                        f'{ {name: len(ids) for name, ids in changed.items()} }')
+
+    def run(self, stop: threading.Event) -> None:
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(**dsl, cursor_factory=DictCursor)
+        listener = psycopg2.connect(**dsl)
+        listener.autocommit = True
+        try:
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            logger.info(f'Лента изменений: слушаем {CHANNEL}')
+            while not stop.is_set():
+                self.docs += self.drain()
+                if self._wait(listener, self.idle_timeout, stop):
+                    self._coalesce(listener)
+        finally:
+            listener.close()
+
+    def _coalesce(self, listener: _connection) -> None:
+        """Ждёт конца всплеска изменений, чтобы перенести его одной пачкой"""
+        deadline = time.monotonic() + self.max_delay
+        while time.monotonic() < deadline:
+            if not self._wait(listener, min(self.coalesce_delay, deadline - time.monotonic())):
+                return
+
+    @staticmethod
+    def _wait(listener: _connection, timeout: float, stop: threading.Event = None) -> bool:
+        """Ждёт уведомлений до timeout секунд; True, если они пришли"""
+        deadline = time.monotonic() + timeout
+        while not listener.notifies:
+            left = deadline - time.monotonic()
+            if left <= 0 or (stop is not None and stop.is_set()):
+                return False
+            # Короткие ожидания, чтобы вовремя заметить остановку
+            if select.select([listener], [], [], min(left, 1)) != ([], [], []):
+                listener.poll()
+        listener.notifies.clear()
+        return True
+
+    @staticmethod
+    def _track(batches: Iterator[list], found: set) -> Iterator[list]:
+        for batch in batches:
+            found.update(str(doc['id']) for doc in batch)
+            yield batch
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'changes': self.changes,
+            'docs': self.docs,
+            'deleted': self.deleted,
+        }
@@ -6,9 +6,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Logging settings
-logging.basicConfig(filename='etl.log', level=os.getenv('LOGGING_LEVEL'))
+logging.basicConfig(filename='etl.log', level=os.getenv('LOGGING_LEVEL', 'INFO'))
 logger = logging.getLogger()
-logger.setLevel(level=os.getenv('LOGGING_LEVEL'))
+logger.setLevel(level=os.getenv('LOGGING_LEVEL', 'INFO'))
 
 dsl = {
     'dbname': os.getenv('POSTGRES_DB'),
@@ -22,3 +22,82 @@ es_conf = [{
     'host': os.getenv('ELASTIC_HOST'),
     'port': os.getenv('ELASTIC_PORT'),
 }]
+
+# Сколько пачек каждая стадия ETL может держать впереди следующей
+etl_buffer_size = int(os.getenv('ETL_BUFFER_SIZE', 4))
+
+# Размер пачки для каждого индекса и сколько строк серверный курсор
+# забирает из Postgres за один запрос
+batch_size = {
+    'movies': int(os.getenv('ETL_MOVIES_BATCH_SIZE', 100)),
+    'genre': int(os.getenv('ETL_GENRE_BATCH_SIZE', 100)),
+    'person': int(os.getenv('ETL_PERSON_BATCH_SIZE', 100)),
+}
+itersize = int(os.getenv('ETL_ITERSIZE', 2000))
+
+# Параметры bulk-записи в Elasticsearch: размер запроса в документах и байтах,
+# число одновременных запросов и повторов для отклонённых документов
+es_bulk = {
+    'chunk_size': int(os.getenv('ES_BULK_CHUNK_SIZE', 500)),
+    'max_chunk_bytes': int(os.getenv('ES_BULK_MAX_BYTES', 10 * 1024 * 1024)),
+    'thread_count': int(os.getenv('ES_BULK_THREADS', 4)),
+    'max_retries': int(os.getenv('ES_BULK_MAX_RETRIES', 3)),
+}
+
+# Полная перезагрузка: индексы пишутся без refresh и реплик,
+# после загрузки их можно слить до одного сегмента
+full_reload = os.getenv('ETL_FULL_RELOAD', 'False').lower() in ('true', '1')
+es_force_merge = os.getenv('ES_FORCE_MERGE', 'False').lower() in ('true', '1')
+
+# Схемы индексов для пересборки в новую версию (movies_v8 и т.п.) и сколько
+# прежних версий оставлять после переключения алиаса
+es_schemas = {
+    'movies': os.path.join(os.path.dirname(__file__), 'schemas_es', 'schemas_film.json'),
+    'genre': os.path.join(os.path.dirname(__file__), 'schemas_es', 'schemas_genre.json'),
+    'person': os.path.join(os.path.dirname(__file__), 'schemas_es', 'schemas_person.json'),
+}
+es_keep_versions = int(os.getenv('ES_KEEP_VERSIONS', 1))
+
+# Отметки инкрементальной загрузки; каталог states смонтирован как volume
+state_file = os.getenv(
+    'ETL_STATE_FILE',
+    os.path.join(os.path.dirname(__file__), 'states', 'PostgresDataState.txt'),
+)
+
+# Режим сервиса: начальный и максимальный интервал опроса Postgres в секундах
+# (пока изменений нет, интервал удваивается) и период вывода статистики
+etl_poll_interval = float(os.getenv('ETL_POLL_INTERVAL', 10))
+etl_poll_max_interval = float(os.getenv('ETL_POLL_MAX_INTERVAL', 60))
+etl_stats_interval = float(os.getenv('ETL_STATS_INTERVAL', 60))
+
+# Лента изменений на триггерах (sql/etl_change_feed.sql): включение и сколько
+# секунд ждать затишья (но не дольше максимума), чтобы слить всплеск в пачку
+etl_change_feed = os.getenv('ETL_CHANGE_FEED', 'False').lower() in ('true', '1')
+etl_feed_coalesce_delay = float(os.getenv('ETL_FEED_COALESCE_DELAY', 0.5))
+etl_feed_max_delay = float(os.getenv('ETL_FEED_MAX_DELAY', 5))
+
+# Сколько процессов преобразуют пачки строк Postgres сразу в строки
+# bulk-запроса; 0 - преобразование в основном процессе
+etl_transform_workers = int(os.getenv('ETL_TRANSFORM_WORKERS', 0))
+
+# Похожие фильмы, заранее посчитанные ETL: индекс со списками и его схема,
+# длина списка и веса близости по жанрам, персонам и рейтингу
+alike_index = os.getenv('ES_ALIKE_INDEX', 'movies_alike')
+alike_schema = os.path.join(os.path.dirname(__file__), 'schemas_es', 'schemas_alike.json')
+alike_size = int(os.getenv('ETL_ALIKE_SIZE', 10))
+alike_weights = {
+    'genre': float(os.getenv('ETL_ALIKE_GENRE_WEIGHT', 1)),
+    'person': float(os.getenv('ETL_ALIKE_PERSON_WEIGHT', 1)),
+    'rating': float(os.getenv('ETL_ALIKE_RATING_WEIGHT', 0.2)),
+}
+
+# Эмбеддинги названия и описания фильмов (хешированный TF-IDF и SVD):
+# число корзин хеширования, вес слов названия, файл рабочей модели рядом
+# с состоянием, индекс словаря, из которого API собирает вектор запроса.
+# Размерность совпадает с dims поля embedding в schemas_film.json
+embedding_buckets = int(os.getenv('ETL_EMBEDDING_BUCKETS', 2 ** 15))
+embedding_dims = 64
+embedding_title_weight = float(os.getenv('ETL_EMBEDDING_TITLE_WEIGHT', 2))
+embedding_model = os.path.join(os.path.dirname(state_file), 'embedding.npz')
+embedding_index = os.getenv('ES_EMBEDDING_INDEX', 'movies_terms')
+embedding_schema = os.path.join(os.path.dirname(__file__), 'schemas_es', 'schemas_terms.json')
@@ -1,41 +1,245 @@
-load_person_q = f'''SELECT DISTINCT id
-                    FROM content.person
-                    GROUP BY id
-                    '''
+def changed_at(alias: str) -> str:
+    """Время изменения строки: updated_at в схеме допускает NULL, тогда берётся
+    created_at, а строка без обеих отметок считается самой старой. По этому
+    выражению (и id) построены индексы sql/etl_indexes.sql
+    """
+    return f"COALESCE({alias}.updated_at, {alias}.created_at, 'epoch')"
+
+
+# Краткие карточки фильмов персоны для её документа: по одной на фильм,
+# роли через запятую, по убыванию рейтинга
+person_films = """(SELECT jsonb_agg(jsonb_build_object(
+                        'id', fw.id,
+                        'title', fw.title,
+                        'imdb_rating', fw.rating,
+                        'role', pf.role
+                    ) ORDER BY fw.rating DESC NULLS LAST, fw.title)
+                    FROM (
+                        SELECT film_work_id, string_agg(DISTINCT role::text, ',' ORDER BY role::text) AS role
+                        FROM content.person_film_work
+                        WHERE person_id = p.id
+                        GROUP BY film_work_id
+                    ) AS pf
+                    JOIN content.film_work as fw ON fw.id = pf.film_work_id) AS films"""
 
 load_person_role = f'''SELECT p.id, p.full_name, p.birth_date,
-                    ARRAY_AGG(DISTINCT pfw.role) AS role,
-                    ARRAY_AGG(DISTINCT pfw.film_work_id) AS film_ids
+                    ARRAY_AGG(DISTINCT pfw.role::text) AS role,
+                    ARRAY_AGG(DISTINCT pfw.film_work_id::text) AS film_ids,
+                    {person_films}
                     FROM content.person as p
                     LEFT JOIN content.person_film_work as pfw ON p.id = pfw.person_id
                     GROUP BY p.id
                     '''
 
-load_film_id = f'''SELECT DISTINCT fw.id
-                    FROM content.film_work as fw
-                    LEFT JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
-                    WHERE pfw.person_id IN (%s)
-                    GROUP BY fw.id
-                    '''
+person_chunk = f'''SELECT p.id, p.full_name, p.birth_date, p.updated_at,
+                    ARRAY_AGG(DISTINCT pfw.role::text) AS role,
+                    ARRAY_AGG(DISTINCT pfw.film_work_id::text) AS film_ids,
+                    {person_films}
+                    FROM (
+                        SELECT p.id, p.full_name, p.birth_date, {changed_at('p')} AS updated_at
+                        FROM content.person as p
+                        WHERE ({changed_at('p')}, p.id) > (%(updated_at)s, %(id)s)
+                        ORDER BY {changed_at('p')}, p.id
+                        LIMIT %(limit)s
+                    ) AS p
+                    LEFT JOIN content.person_film_work as pfw ON p.id = pfw.person_id
+                    GROUP BY p.id, p.full_name, p.birth_date, p.updated_at
+                    ORDER BY p.updated_at, p.id'''
 
-big_request = """ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) AS genre,
-ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'director') AS director,
+# Персоны и жанры фильма агрегируются отдельно друг от друга: строки связей
+# не перемножаются (персоны x жанры), и внешний DISTINCT не нужен
+person_aggregates = """ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'director') AS director,
 ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'actor') AS actors,
 ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'writer') AS writers,
 ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor') AS actors_names,
-ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names"""
-
-full_load = f'''SELECT DISTINCT fw.id, fw.title, fw.description, fw.rating, fw.type,
-                          fw.updated_at, {big_request}
-                            FROM content.film_work as fw
-                            LEFT JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
-                            LEFT JOIN content.person as p ON p.id = pfw.person_id
-                            LEFT JOIN content.genre_film_work as gfw ON gfw.film_work_id = fw.id
-                            LEFT JOIN content.genre as g ON g.id = gfw.genre_id
-                            WHERE fw.id IN (%s)
-                            GROUP BY fw.id
-                            ORDER BY fw.updated_at;'''
+ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names
+FROM content.person_film_work as pfw
+JOIN content.person as p ON p.id = pfw.person_id"""
+
+genre_aggregates = """ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) AS genre
+FROM content.genre_film_work as gfw
+JOIN content.genre as g ON g.id = gfw.genre_id"""
+
+film_columns = """fw.id, fw.title, fw.description, fw.rating, fw.type, fw.updated_at,
+g.genre, p.director, p.actors, p.writers, p.actors_names, p.writers_names"""
+
+# Полная выгрузка: связи агрегируются целиком и соединяются хешем.
+# Внутренний JOIN с персонами оставляет фильмы, у которых есть персоны
+full_load = f'''SELECT {film_columns}
+                    FROM content.film_work as fw
+                    JOIN (
+                        SELECT pfw.film_work_id, {person_aggregates}
+                        GROUP BY pfw.film_work_id
+                    ) AS p ON p.film_work_id = fw.id
+                    LEFT JOIN (
+                        SELECT gfw.film_work_id, {genre_aggregates}
+                        GROUP BY gfw.film_work_id
+                    ) AS g ON g.film_work_id = fw.id
+                    ORDER BY fw.updated_at'''
+
+# Пачка по id: LATERAL читает связи только этих фильмов по индексам.
+# Фильмы без персон отсеиваются, как в full_load и film_chunk
+film_by_ids = f'''SELECT {film_columns}
+                    FROM content.film_work as fw
+                    LEFT JOIN LATERAL (
+                        SELECT {genre_aggregates}
+                        WHERE gfw.film_work_id = fw.id
+                    ) AS g ON TRUE
+                    LEFT JOIN LATERAL (
+                        SELECT {person_aggregates}
+                        WHERE pfw.film_work_id = fw.id
+                    ) AS p ON TRUE
+                    WHERE fw.id = ANY(%(ids)s::uuid[])
+                    AND EXISTS (SELECT 1 FROM content.person_film_work as pfw WHERE pfw.film_work_id = fw.id)
+                    ORDER BY fw.updated_at'''
+
+# Полная выгрузка ключевой пагинацией: (changed_at, id) > позиции прошлой
+# пачки, индекс (changed_at, id) отдаёт каждую пачку без сортировки таблицы.
+# Фильмы без персон отсеиваются до LIMIT, чтобы пачка не вышла пустой
+# посреди таблицы
+film_chunk = f'''SELECT {film_columns}
+                    FROM (
+                        SELECT fw.id, fw.title, fw.description, fw.rating, fw.type,
+                        {changed_at('fw')} AS updated_at
+                        FROM content.film_work as fw
+                        WHERE ({changed_at('fw')}, fw.id) > (%(updated_at)s, %(id)s)
+                        AND EXISTS (SELECT 1 FROM content.person_film_work as pfw WHERE pfw.film_work_id = fw.id)
+                        ORDER BY {changed_at('fw')}, fw.id
+                        LIMIT %(limit)s
+                    ) AS fw
+                    LEFT JOIN LATERAL (
+                        SELECT {genre_aggregates}
+                        WHERE gfw.film_work_id = fw.id
+                    ) AS g ON TRUE
+                    LEFT JOIN LATERAL (
+                        SELECT {person_aggregates}
+                        WHERE pfw.film_work_id = fw.id
+                    ) AS p ON TRUE
+                    ORDER BY fw.updated_at, fw.id'''
 
 query_all_genre = f'''SELECT id, name, description
                  FROM content.genre
                  ORDER BY created_at;'''
+
+genre_chunk = f'''SELECT g.id, g.name, g.description, {changed_at('g')} AS updated_at
+                 FROM content.genre as g
+                 WHERE ({changed_at('g')}, g.id) > (%(updated_at)s, %(id)s)
+                 ORDER BY {changed_at('g')}, g.id
+                 LIMIT %(limit)s'''
+
+# Инкрементальная загрузка. Отметка каждой таблицы - последний обработанный
+# changed_at (у таблиц связей - created_at); окно изменений (since, until].
+# Удаления строк по отметкам не видны: удалённые документы убирает сверка
+# id (load_data.remove_deleted), а удалённые связи - только лента изменений
+
+marks_query = f'''SELECT
+                    (SELECT MAX({changed_at('fw')}) FROM content.film_work as fw) AS film_work,
+                    (SELECT MAX({changed_at('p')}) FROM content.person as p) AS person,
+                    (SELECT MAX({changed_at('g')}) FROM content.genre as g) AS genre,
+                    (SELECT MAX(created_at) FROM content.person_film_work) AS person_film_work,
+                    (SELECT MAX(created_at) FROM content.genre_film_work) AS genre_film_work'''
+
+changed_film_ids = f'''SELECT fw.id
+                    FROM content.film_work as fw
+                    WHERE {changed_at('fw')} > %(film_work)s AND {changed_at('fw')} <= %(film_work_until)s
+                    UNION
+                    SELECT pfw.film_work_id
+                    FROM content.person as p
+                    JOIN content.person_film_work as pfw ON pfw.person_id = p.id
+                    WHERE {changed_at('p')} > %(person)s AND {changed_at('p')} <= %(person_until)s
+                    UNION
+                    SELECT gfw.film_work_id
+                    FROM content.genre as g
+                    JOIN content.genre_film_work as gfw ON gfw.genre_id = g.id
+                    WHERE {changed_at('g')} > %(genre)s AND {changed_at('g')} <= %(genre_until)s
+                    UNION
+                    SELECT film_work_id
+                    FROM content.person_film_work
+                    WHERE created_at > %(person_film_work)s AND created_at <= %(person_film_work_until)s
+                    UNION
+                    SELECT film_work_id
+                    FROM content.genre_film_work
+                    WHERE created_at > %(genre_film_work)s AND created_at <= %(genre_film_work_until)s'''
+
+changed_person_ids = f'''SELECT p.id
+                    FROM content.person as p
+                    WHERE {changed_at('p')} > %(person)s AND {changed_at('p')} <= %(person_until)s
+                    UNION
+                    SELECT person_id
+                    FROM content.person_film_work
+                    WHERE created_at > %(person_film_work)s AND created_at <= %(person_film_work_until)s
+                    UNION
+                    SELECT pfw.person_id
+                    FROM content.film_work as fw
+                    JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
+                    WHERE {changed_at('fw')} > %(film_work)s AND {changed_at('fw')} <= %(film_work_until)s'''
+
+changed_genre_ids = f'''SELECT g.id
+                    FROM content.genre as g
+                    WHERE {changed_at('g')} > %(genre)s AND {changed_at('g')} <= %(genre_until)s'''
+
+# id документов, которые должны быть в индексах: с ними сверяется индекс,
+# чтобы удалить документы строк, которых больше нет
+film_ids = '''SELECT fw.id
+                    FROM content.film_work as fw
+                    WHERE EXISTS (SELECT 1 FROM content.person_film_work as pfw WHERE pfw.film_work_id = fw.id)'''
+
+person_ids = '''SELECT id FROM content.person'''
+
+genre_ids = '''SELECT id FROM content.genre'''
+
+person_by_ids = f'''SELECT p.id, p.full_name, p.birth_date,
+                    ARRAY_AGG(DISTINCT pfw.role::text) AS role,
+                    ARRAY_AGG(DISTINCT pfw.film_work_id::text) AS film_ids,
+                    {person_films}
+                    FROM content.person as p
+                    LEFT JOIN content.person_film_work as pfw ON p.id = pfw.person_id
+                    WHERE p.id = ANY(%(ids)s::uuid[])
+                    GROUP BY p.id
+                    '''
+
+genre_by_ids = f'''SELECT id, name, description
+                 FROM content.genre
+                 WHERE id = ANY(%(ids)s::uuid[])
+                 ORDER BY created_at;'''
+
+# Лента изменений (sql/etl_change_feed.sql): записи читаются по порядку
+# и удаляются после обработки
+
+change_log_query = '''SELECT id, table_name, ids
+                    FROM content.change_log
+                    ORDER BY id
+                    LIMIT %(limit)s'''
+
+change_log_ack = '''DELETE FROM content.change_log WHERE id = ANY(%(ids)s)'''
+
+films_by_person = '''SELECT DISTINCT film_work_id
+                    FROM content.person_film_work
+                    WHERE person_id = ANY(%(ids)s::uuid[])'''
+
+persons_by_film = '''SELECT DISTINCT person_id
+                    FROM content.person_film_work
+                    WHERE film_work_id = ANY(%(ids)s::uuid[])'''
+
+films_by_genre = '''SELECT DISTINCT film_work_id
+                    FROM content.genre_film_work
+                    WHERE genre_id = ANY(%(ids)s::uuid[])'''
+
+# Признаки фильмов для расчёта похожих: те же фильмы, что в индексе movies
+alike_features = '''SELECT fw.id, fw.title, fw.rating, g.genre_ids, p.person_ids
+                    FROM content.film_work as fw
+                    JOIN (
+                        SELECT film_work_id, ARRAY_AGG(DISTINCT person_id::text) AS person_ids
+                        FROM content.person_film_work
+                        GROUP BY film_work_id
+                    ) AS p ON p.film_work_id = fw.id
+                    LEFT JOIN (
+                        SELECT film_work_id, ARRAY_AGG(DISTINCT genre_id::text) AS genre_ids
+                        FROM content.genre_film_work
+                        GROUP BY film_work_id
+                    ) AS g ON g.film_work_id = fw.id'''
+
+# Тексты фильмов для модели эмбеддингов, которую считает пересборка movies
+film_texts = '''SELECT id, title, description
+                    FROM content.film_work
+                    ORDER BY id'''
@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from config import (embedding_buckets, embedding_dims, embedding_index,
+                    embedding_model, embedding_schema, embedding_title_weight,
+                    es_keep_versions)
+from es import EsSaver
+
+logger = logging.getLogger('Embedding')
+
+# Слова так же выделяет API (src/services/film.py), когда собирает вектор
+# запроса из словаря: правила должны совпадать
+TOKEN = re.compile(r'\w+')
+# Сколько ненулевых элементов перемножается за раз, чтобы память
+# на промежуточный массив не росла с каталогом
+CHUNK = 1 << 20
+
+
+def tokenize(text: Optional[str]) -> list:
+    return TOKEN.findall(text.lower()) if text else []
+
+
+class Sparse:
+    """Разреженная матрица в CSR: у строки i столбцы indices[ptr[i]:ptr[i + 1]]"""
+
+    def __init__(self, rows: np.ndarray, cols: np.ndarray, data: np.ndarray,
+                 shape: tuple):
+        order = np.lexsort((cols, rows))
+        self.shape = shape
+        self.rows = rows[order]
+        self.indices = cols[order]
+        self.data = data[order].astype(np.float32)
+        self.ptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=shape[0]))))
+
+    @property
+    def T(self) -> 'Sparse':
+        return Sparse(self.indices, self.rows, self.data, self.shape[::-1])
+
+    def dot(self, dense: np.ndarray) -> np.ndarray:
+        """Произведение на плотную матрицу, по CHUNK ненулевых элементов"""
+        out = np.zeros((self.shape[0], dense.shape[1]), dtype=np.float32)
+        start = 0
+        while start < self.shape[0]:
+            end = int(np.searchsorted(self.ptr, self.ptr[start] + CHUNK, side='right')) - 1
+            end = max(end, start + 1)
+            lo, hi = self.ptr[start], self.ptr[end]
+            filled = start + np.flatnonzero(np.diff(self.ptr[start:end + 1]))
+            if len(filled):
+                products = self.data[lo:hi, None] * dense[self.indices[lo:hi]]
+                out[filled] = np.add.reduceat(products, self.ptr[filled] - lo, axis=0)
+            start = end
+        return out
+
+
+def term_counts(rows: list, buckets: int, title_weight: float) -> tuple:
+    """Частоты слов названия и описания по корзинам хеширования.
+
+    Возвращает матрицу фильмы x корзины с log(1 + tf) и словарь: слова
+    и их корзины. Хешируется каждое слово один раз, а не каждое вхождение;
+    crc32, а не hash(), потому что он одинаков во всех процессах.
+    """
+    films, tokens, weights = [], [], []
+    for film, row in enumerate(rows):
+        for field, weight in (('title', title_weight), ('description', 1.0)):
+            words = tokenize(row[field])
+            films += [film] * len(words)
+            tokens += words
+            weights += [weight] * len(words)
+    vocabulary, inverse = np.unique(np.array(tokens, dtype=str), return_inverse=True)
+    hashed = np.fromiter((zlib.crc32(token.encode()) % buckets for token in vocabulary),
+                         dtype=np.int64, count=len(vocabulary))
+    keys = np.array(films, dtype=np.int64) * buckets + hashed[inverse.ravel()]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    tf = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+    matrix = Sparse(keys // buckets, keys % buckets, np.log1p(tf), (len(rows), buckets))
+    return matrix, (vocabulary, hashed)
+
+
+def tfidf(matrix: Sparse, idf: np.ndarray) -> Sparse:
+    """TF-IDF с единичной нормой строк"""
+    data = matrix.data * idf[matrix.indices]
+    norms = np.sqrt(np.bincount(matrix.rows, weights=data ** 2, minlength=matrix.shape[0]))
+    return Sparse(matrix.rows, matrix.indices, data / norms[matrix.rows], matrix.shape)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Единичная норма строк; нулевые строки (фильм без слов) остаются нулевыми"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def randomized_svd(matrix: Sparse, dims: int, seed: int = 0,
+                   oversample: int = 10, iterations: int = 4) -> np.ndarray:
+    """Первые dims правых сингулярных векторов, столбцами корзины x dims.
+
+    Рандомизированный SVD (Halko и др.): матрица нужна только в
+    произведениях на плотные, так что она остаётся разреженной.
+    """
+    rank = min(dims + oversample, *matrix.shape)
+    rand = np.random.default_rng(seed)
+    transposed = matrix.T
+    sample = rand.standard_normal((matrix.shape[1], rank), dtype=np.float32)
+    q = np.linalg.qr(matrix.dot(sample))[0]
+    for _ in range(iterations):
+        q = np.linalg.qr(transposed.dot(q))[0]
+        q = np.linalg.qr(matrix.dot(q))[0]
+    # Правые векторы проекции Q^T X совпадают с правыми векторами X
+    vt = np.linalg.svd(transposed.dot(q).T, full_matrices=False)[2][:dims]
+    components = np.zeros((matrix.shape[1], dims), dtype=np.float32)
+    components[:, :len(vt)] = vt.T
+    return components
+
+
+class TextEmbedder:
+    """Векторы названия и описания фильма: хешированный TF-IDF, сжатый SVD (LSA).
+
+    Модель - idf корзин и проекция корзин в dims измерений; она считается
+    при пересборке индекса фильмов и до следующей пересборки не меняется,
+    иначе векторы старых и новых документов окажутся несравнимы. Слова
+    словаря публикуются для API: вектор запроса - сумма их векторов.
+    """
+
+    def __init__(self, idf: np.ndarray, components: np.ndarray,
+                 title_weight: float, vocabulary: tuple):
+        self.idf = idf
+        self.components = components
+        self.title_weight = title_weight
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def fit(cls, rows: list, buckets: int = embedding_buckets,
+            dims: int = embedding_dims,
+            title_weight: float = embedding_title_weight) -> 'TextEmbedder':
+        start = time.monotonic()
+        matrix, vocabulary = term_counts(rows, buckets, title_weight)
+        df = np.bincount(matrix.indices, minlength=buckets)
+        idf = (np.log((1 + len(rows)) / (1 + df)) + 1).astype(np.float32)
+        # SVD только по занятым корзинам: у пустых компоненты нулевые
+        active = np.flatnonzero(df)
+        column = np.zeros(buckets, dtype=np.int64)
+        column[active] = np.arange(len(active))
+        weighted = tfidf(matrix, idf)
+        compact = Sparse(weighted.rows, column[weighted.indices], weighted.data,
+                         (len(rows), len(active)))
+        components = np.zeros((buckets, dims), dtype=np.float32)
+        components[active] = randomized_svd(compact, dims)
+        logger.info(f'Модель эмбеддингов: {len(rows)} фильмов, {len(vocabulary[0])} слов, '
+                    f'{time.monotonic() - start:.2f} с')
+        return cls(idf, components, title_weight, vocabulary)
+
+    def encode(self, rows: list) -> np.ndarray:
+        """Векторы пачки строк с title и description, по строке на фильм"""
+        matrix, _ = term_counts(rows, len(self.idf), self.title_weight)
+        return normalize(tfidf(matrix, self.idf).dot(self.components))
+
+    def terms(self, batch_size: int = 1000) -> Iterator[list]:
+        """Пачки документов словаря: слово и его вклад в вектор запроса"""
+        tokens, hashed = self.vocabulary
+        for start in range(0, len(tokens), batch_size):
+            buckets = hashed[start:start + batch_size]
+            vectors = self.idf[buckets, None] * self.components[buckets]
+            yield [{'id': token, 'vector': vector.tolist()}
+                   for token, vector in zip(tokens[start:start + batch_size], vectors)]
+
+    def save(self, path: str) -> None:
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, idf=self.idf, components=self.components,
+                     title_weight=self.title_weight,
+                     tokens=self.vocabulary[0], hashed=self.vocabulary[1])
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'TextEmbedder':
+        with np.load(path) as data:
+            return cls(data['idf'], data['components'], float(data['title_weight']),
+                       (data['tokens'], data['hashed']))
+
+
+def model_path(index: str) -> str:
+    """Файл модели версии индекса, пока она пересобирается"""
+    return os.path.join(os.path.dirname(embedding_model), f'embedding_{index}.npz')
+
+
+@lru_cache(maxsize=1)
+def _load(path: str, mtime: float) -> TextEmbedder:
+    return TextEmbedder.load(path)
+
+
+def current_embedder() -> Optional[TextEmbedder]:
+    """Модель, которой посчитаны векторы рабочего индекса, или None"""
+    try:
+        return _load(embedding_model, os.path.getmtime(embedding_model))
+    except FileNotFoundError:
+        return None
+
+
+def saved_embedder(index: str) -> Optional[TextEmbedder]:
+    """Модель прерванной пересборки index: продолжение считает ею же"""
+    path = model_path(index)
+    return TextEmbedder.load(path) if os.path.exists(path) else None
+
+
+def fit_embedder(index: str, rows: Iterable) -> TextEmbedder:
+    embedder = TextEmbedder.fit(list(rows))
+    embedder.save(model_path(index))
+    return embedder
+
+
+def publish_embedder(saver: EsSaver, embedder: TextEmbedder, index: str) -> None:
+    """Делает модель версии index рабочей: словарь для API и файл для
+    инкрементальных загрузок. Вызывается прямо перед переключением алиаса
+    индекса, чтобы векторы запросов и документов считались одной моделью.
+    """
+    with open(embedding_schema) as f:
+        terms = saver.create_index(embedding_index, json.load(f))
+    saver.load(embedder.terms(), terms)
+    saver.swap_alias(embedding_index, terms, keep=es_keep_versions)
+    os.replace(model_path(index), embedding_model)
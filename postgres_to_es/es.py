@@ -1,42 +1,341 @@
-import json
 import logging
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
 
-from elasticsearch import Elasticsearch
-from utils import backoff
+import orjson
+from elasticsearch import Elasticsearch, ElasticsearchException, helpers
+from pipeline import ordered_map
+from state import State
 
 
 logger = logging.getLogger('ESLoader')
 
 
+class IndexValidationError(Exception):
+    """Новая версия индекса не совпадает с источником, алиас не переключается"""
+
+
+BULK_SETTINGS = {
+    'index.refresh_interval': '-1',
+    'index.number_of_replicas': 0,
+}
+
+
+def to_ndjson(docs: Iterable[dict], name_index: str) -> list:
+    """Документы в готовые строки bulk-запроса: пары (id, действие и документ)"""
+    lines = []
+    for doc in docs:
+        action = orjson.dumps({'index': {'_index': name_index, '_id': doc['id']}})
+        lines.append((doc['id'], action + b'\n' + orjson.dumps(doc) + b'\n'))
+    return lines
+
+
+def bulk_chunks(batches: Iterable[list], chunk_size: int,
+                max_chunk_bytes: int) -> Iterator[tuple]:
+    """Склеивает пачки строк to_ndjson в запросы по chunk_size документов или
+    max_chunk_bytes байт. Вместе с запросом отдаются пачки, последний документ
+    которых в него попал: они приняты, когда принят этот запрос.
+    """
+    chunk, size, finished = [], 0, []
+    for batch in batches:
+        for line in batch:
+            chunk.append(line)
+            size += len(line[1])
+            if len(chunk) >= chunk_size or size >= max_chunk_bytes:
+                yield chunk, finished
+                chunk, size, finished = [], 0, []
+        finished.append(batch)
+    if chunk or finished:
+        yield chunk, finished
+
+
+def parse_bulk(chunk: list, response: dict, name_index: str,
+               retry: bool) -> tuple:
+    """Разбирает ответ bulk: (записано, ошибок, отклонённые с 429 для повтора)"""
+    indexed, failed, rejected = 0, 0, []
+    for (doc_id, line), item in zip(chunk, response['items']):
+        status = next(iter(item.values())).get('status', 500)
+        if status < 300:
+            indexed += 1
+        elif status == 429 and retry:
+            rejected.append((doc_id, line))
+        else:
+            failed += 1
+            logger.error(f'Документ {doc_id} не записан в {name_index}: {item}')
+    return indexed, failed, rejected
+
+
+def report(name_index: str, indexed: int, failed: int, start: float) -> None:
+    elapsed = time.monotonic() - start
+    logger.info(
+        f'{name_index}: записано {indexed} документов, ошибок {failed}, '
+        f'{elapsed:.2f} с, {indexed / elapsed if elapsed else 0:.0f} док/с'
+    )
+
+
 class EsSaver:
-    def __init__(self, host: list, state_key='my_key'):
+    def __init__(self, host: list, chunk_size: int = 500,
+                 max_chunk_bytes: int = 10 * 1024 * 1024,
+                 thread_count: int = 4, max_retries: int = 3):
         self.client = Elasticsearch(host)
-        self.movies_list = []
-        self.key = state_key
-
-    @backoff()
-    def load_data(self, name_index) -> None:
-        self.client.bulk(body='\n'.join(self.movies_list) + '\n', index=name_index, refresh=True)
-
-    def load(self, query, name_index) -> None:
-        while query:
-            rows = iter(query)
-            for row in rows:
-                self.movies_list.extend(
-                    [
-                        json.dumps(
-                            {
-                                'index': {
-                                    '_index': name_index,
-                                    '_id': row['id']
-                                }
-                            }
-                        ),
-                        json.dumps(row),
-                    ]
-                )
-                if len(self.movies_list) == 50:
-                    self.load_data(name_index)
-                    self.movies_list.clear()
-            self.load_data(name_index)
-            break
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.thread_count = thread_count
+        self.max_retries = max_retries
+
+    def load(self, batches: Iterable[list], name_index,
+             on_batch: Optional[Callable[[list], None]] = None) -> int:
+        """Пишет пачки документов в индекс параллельными bulk-запросами.
+
+        Одновременно в полёте не больше thread_count запросов, индекс
+        обновляется один раз в конце. on_batch вызывается по порядку для
+        каждой пачки, когда она и все пачки до неё приняты кластером.
+        Возвращает число записанных документов.
+        """
+        # parallel_bulk отдаёт результаты в порядке действий, поэтому
+        # документ для повтора берётся из начала очереди отправленных
+        sent = deque()
+        # Сколько действий должно быть подтверждено к концу каждой пачки
+        bounds = deque()
+
+        def actions():
+            total = 0
+            for batch in batches:
+                total += len(batch)
+                bounds.append((total, batch))
+                for row in batch:
+                    action = {'_index': name_index, '_id': row['id'], '_source': row}
+                    sent.append(action)
+                    yield action
+
+        def commit(done: int) -> None:
+            while bounds and bounds[0][0] <= done:
+                batch = bounds.popleft()[1]
+                if on_batch is not None:
+                    on_batch(batch)
+
+        start = time.monotonic()
+        done, indexed, failed = 0, 0, 0
+        rejected = []
+        for ok, item in helpers.parallel_bulk(
+                self.client,
+                actions(),
+                thread_count=self.thread_count,
+                queue_size=self.thread_count,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+        ):
+            action = sent.popleft()
+            done += 1
+            if ok:
+                indexed += 1
+            elif next(iter(item.values())).get('status') == 429:
+                rejected.append(action)
+            else:
+                failed += 1
+                logger.error(f'Документ {action["_id"]} не записан в {name_index}: {item}')
+            # Отклонённые документы повторяются до подтверждения их пачки
+            if bounds and bounds[0][0] <= done:
+                if rejected:
+                    retried, still_failed = self._retry(rejected)
+                    indexed += retried
+                    failed += still_failed
+                    rejected = []
+                commit(done)
+
+        if rejected:
+            retried, still_failed = self._retry(rejected)
+            indexed += retried
+            failed += still_failed
+        commit(done)
+
+        self.client.indices.refresh(index=name_index)
+        report(name_index, indexed, failed, start)
+        return indexed
+
+    def load_ndjson(self, batches: Iterable[list], name_index: str,
+                    on_batch: Optional[Callable[[list], None]] = None) -> int:
+        """Пишет пачки готовых строк из to_ndjson, иначе как load.
+
+        Строки уходят в запросы как есть, без повторной сериализации;
+        запросы выполняются в thread_count потоках, результаты разбираются
+        в порядке отправки.
+        """
+        def send(item: tuple) -> tuple:
+            chunk, finished = item
+            return (self._send(chunk, name_index) if chunk else (0, 0)), finished
+
+        start = time.monotonic()
+        indexed, failed = 0, 0
+        chunks = bulk_chunks(batches, self.chunk_size, self.max_chunk_bytes)
+        with ThreadPoolExecutor(self.thread_count) as executor:
+            for (ok, errors), finished in ordered_map(executor, send, chunks, self.thread_count):
+                indexed += ok
+                failed += errors
+                if on_batch is not None:
+                    for batch in finished:
+                        on_batch(batch)
+
+        self.client.indices.refresh(index=name_index)
+        report(name_index, indexed, failed, start)
+        return indexed
+
+    def _send(self, chunk: list, name_index: str) -> tuple:
+        """Один bulk-запрос; отклонённые кластером (429) документы повторяются с паузой"""
+        indexed, failed = 0, 0
+        for attempt in range(self.max_retries + 1):
+            response = self.client.bulk(body=b''.join(line for _, line in chunk))
+            ok, errors, chunk = parse_bulk(chunk, response, name_index,
+                                           retry=attempt < self.max_retries)
+            indexed += ok
+            failed += errors
+            if not chunk:
+                break
+            logger.warning(f'Кластер отклонил {len(chunk)} документов, повторяем')
+            time.sleep(min(2 ** attempt, 30))
+        return indexed, failed
+
+    def delete(self, ids: Iterable[str], name_index: str) -> int:
+        """Удаляет документы, которых больше нет в источнике"""
+        actions = ({'_op_type': 'delete', '_index': name_index, '_id': doc_id} for doc_id in ids)
+        deleted = 0
+        for ok, item in helpers.streaming_bulk(self.client, actions, chunk_size=self.chunk_size,
+                                               raise_on_error=False):
+            if ok:
+                deleted += 1
+            # 404 - документа уже нет, что и требовалось
+            elif next(iter(item.values())).get('status') != 404:
+                logger.error(f'Документ не удалён из {name_index}: {item}')
+        self.client.indices.refresh(index=name_index)
+        return deleted
+
+    @contextmanager
+    def bulk_mode(self, name_index: str, state: Optional[State] = None,
+                  force_merge: bool = False) -> Iterator[None]:
+        """Отключает refresh и реплики индекса на время полной загрузки.
+
+        Исходные настройки возвращаются и при ошибке загрузки. Они же
+        сохраняются в state: если процесс упал посреди загрузки, следующий
+        запуск восстановит их, а не примет -1 за исходное значение.
+        """
+        key = f'bulk_mode_{name_index}'
+        original = state.get_state(key) if state else None
+        if original is None:
+            original = self._get_settings(name_index)
+            if state:
+                state.set_state(key, original)
+        logger.info(f'{name_index}: bulk-режим, исходные настройки {original}')
+        self._put_settings(name_index, BULK_SETTINGS)
+        loaded = False
+        try:
+            yield
+            loaded = True
+        finally:
+            # Ключ state стирается, только когда настройки действительно
+            # вернулись: иначе их восстановит следующий запуск
+            self._put_settings(name_index, original)
+            if state:
+                state.set_state(key, None)
+            self.client.indices.refresh(index=name_index)
+            logger.info(f'{name_index}: настройки восстановлены')
+        if loaded and force_merge:
+            self.client.indices.forcemerge(index=name_index, max_num_segments=1)
+
+    def create_index(self, alias: str, body: dict) -> str:
+        """Создаёт пустой индекс следующей версии для алиаса, например movies_v8"""
+        versions = self._versions(alias)
+        index = f'{alias}_v{versions[-1][0] + 1 if versions else 1}'
+        self.client.indices.create(index=index, body=body)
+        logger.info(f'Создан индекс {index}')
+        return index
+
+    def count(self, index: str) -> int:
+        return self.client.count(index=index)['count']
+
+    def ids(self, name_index: str) -> Iterator[str]:
+        """id всех документов индекса, без самих документов"""
+        for hit in helpers.scan(self.client, index=name_index, query={'_source': False},
+                                size=self.chunk_size):
+            yield hit['_id']
+
+    def swap_alias(self, alias: str, index: str, keep: int = 1) -> None:
+        """Атомарно переключает алиас на index.
+
+        Индекс, созданный раньше под именем самого алиаса, удаляется в той же
+        операции. Из прежних версий остаются keep последних для отката.
+        """
+        actions = [{'add': {'index': index, 'alias': alias}}]
+        if self.client.indices.exists_alias(name=alias):
+            actions += [
+                {'remove': {'index': name, 'alias': alias}}
+                for name in self.client.indices.get_alias(name=alias) if name != index
+            ]
+        elif self.client.indices.exists(index=alias):
+            actions.append({'remove_index': {'index': alias}})
+        self.client.indices.update_aliases(body={'actions': actions})
+        logger.info(f'Алиас {alias} переключён на {index}')
+
+        old = [(number, name) for number, name in self._versions(alias) if name != index]
+        stale = [name for _, name in old[:max(len(old) - keep, 0)]]
+        if stale:
+            self.client.indices.delete(index=','.join(stale))
+            logger.info(f'Удалены старые версии {stale}')
+
+    def _versions(self, alias: str) -> list:
+        """Пары (номер, имя) существующих версий алиаса по возрастанию"""
+        version = re.compile(rf'{re.escape(alias)}_v(\d+)')
+        return sorted(
+            (int(m.group(1)), m.group(0))
+            for m in map(version.fullmatch, self.client.indices.get(index=f'{alias}_v*'))
+            if m
+        )
+
+    def _get_settings(self, name_index: str) -> dict:
+        response = self.client.indices.get_settings(
+            index=name_index,
+            name=list(BULK_SETTINGS),
+            include_defaults=True,
+            flat_settings=True,
+        )
+        # Для алиаса ответ приходит под именем самого индекса
+        index = next(iter(response.values()))
+        current = {**index.get('defaults', {}), **index.get('settings', {})}
+        return {name: current.get(name) for name in BULK_SETTINGS}
+
+    def _put_settings(self, name_index: str, settings: dict) -> None:
+        """Повторяет запрос с паузой; после max_retries повторов ошибка
+        пробрасывается, иначе bulk_mode забудет исходные настройки
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.client.indices.put_settings(body=settings, index=name_index)
+                return
+            except ElasticsearchException:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f'{name_index}: настройки не записаны, повторяем')
+                time.sleep(min(2 ** attempt, 30))
+
+    def _retry(self, rejected: list) -> tuple:
+        """Повторяет только отклонённые кластером (429) документы с паузой"""
+        logger.warning(f'Кластер отклонил {len(rejected)} документов, повторяем')
+        indexed, failed = 0, 0
+        for ok, item in helpers.streaming_bulk(
+                self.client,
+                rejected,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                max_retries=self.max_retries,
+                raise_on_error=False,
+        ):
+            if ok:
+                indexed += 1
+            else:
+                failed += 1
+                logger.error(f'Документ не записан после повторов: {item}')
+        return indexed, failed
@@ -0,0 +1,178 @@
+import logging
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import psycopg2
+from psycopg2.extensions import connection as _connection
+from psycopg2.extras import DictCursor
+
+from alike import AlikeIndex, sync_alike
+from change_feed import ChangeFeed
+from config import (alike_size, alike_weights, dsl, es_bulk, es_conf,
+                    etl_change_feed, etl_feed_coalesce_delay, etl_feed_max_delay,
+                    etl_poll_interval, etl_poll_max_interval,
+                    etl_stats_interval, full_reload, state_file)
+from es import EsSaver
+from load_data import LOADERS, sync_index
+from postgresloader import NO_MARK
+from state import JsonFileStorage, State
+
+logger = logging.getLogger('EtlService')
+
+
+class IndexWorker(threading.Thread):
+    """Поток, который держит соединение с Postgres и синхронизирует один индекс.
+
+    Пока изменений нет, пауза между опросами растёт вдвое от poll_interval
+    до max_interval и сбрасывается при первой же найденной пачке.
+    """
+
+    def __init__(self, name_index: str, saver: EsSaver, state: State,
+                 stop: threading.Event, poll_interval: float,
+                 max_interval: float, full: bool = False,
+                 alike: Optional[AlikeIndex] = None):
+        super().__init__(name=f'etl-{name_index}', daemon=True)
+        self.name_index = name_index
+        self.saver = saver
+        self.state = state
+        self.stop = stop
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.full = full
+        self.alike = alike
+        self.conn: Optional[_connection] = None
+
+        self.cycles = 0
+        self.errors = 0
+        self.docs = 0
+        self.busy = 0.0
+        self.lag: Optional[float] = None
+
+    def run(self) -> None:
+        interval = self.poll_interval
+        while not self.stop.is_set():
+            try:
+                indexed = self.cycle()
+            except Exception:
+                self.errors += 1
+                logger.exception(f'{self.name_index}: ошибка цикла, переподключение')
+                self.close()
+                indexed = 0
+            interval = self.poll_interval if indexed else min(interval * 2, self.max_interval)
+            self.stop.wait(interval)
+        self.close()
+
+    def cycle(self) -> int:
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(**dsl, cursor_factory=DictCursor)
+        start = time.monotonic()
+        # Транзакция закрывается после цикла, соединение остаётся открытым
+        with self.conn:
+            indexed = sync_index(self.conn, self.saver, self.name_index,
+                                 self.state, full=self.full)
+            # Списки держатся в памяти: после старта они считаются целиком,
+            # дальше только для фильмов, чьи признаки изменились
+            if self.alike is not None and (indexed or not self.alike.docs):
+                sync_alike(self.conn, self.saver, self.alike)
+        self.full = False
+        self.cycles += 1
+        self.busy += time.monotonic() - start
+        if indexed:
+            self.docs += indexed
+            self.lag = self._lag()
+        return indexed
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _lag(self) -> Optional[float]:
+        """Секунды от самого свежего обработанного изменения до его записи"""
+        # У пустой таблицы отметка NO_MARK, в задержку она не входит
+        marks = [mark for mark in (self.state.get_state(self.name_index) or {}).values()
+                 if mark and mark != NO_MARK]
+        if not marks:
+            return None
+        newest = max(datetime.fromisoformat(mark) for mark in marks)
+        return (datetime.now(timezone.utc) - newest).total_seconds()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'cycles': self.cycles,
+            'errors': self.errors,
+            'docs': self.docs,
+            'docs_per_sec': round(self.docs / self.busy, 1) if self.busy else 0,
+            'lag_sec': round(self.lag, 1) if self.lag is not None else None,
+        }
+
+
+class EtlService:
+    """Долгоживущий ETL: индексы синхронизируются параллельно до SIGTERM/SIGINT.
+
+    С ETL_CHANGE_FEED рядом работает лента изменений на LISTEN/NOTIFY, а опрос
+    по отметкам остаётся страховкой и может идти с большим интервалом.
+    """
+
+    def __init__(self, state: State, indices: tuple = tuple(LOADERS)):
+        self.stop = threading.Event()
+        saver = EsSaver(es_conf, **es_bulk)
+        self.workers = [
+            IndexWorker(name_index, saver, state, self.stop,
+                        poll_interval=etl_poll_interval,
+                        max_interval=etl_poll_max_interval,
+                        full=full_reload,
+                        alike=(AlikeIndex(alike_size, alike_weights)
+                               if name_index == 'movies' else None))
+            for name_index in indices
+        ]
+        self.feed = None
+        if etl_change_feed:
+            self.feed = ChangeFeed(None, saver,
+                                   coalesce_delay=etl_feed_coalesce_delay,
+                                   max_delay=etl_feed_max_delay)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+        threads = list(self.workers)
+        if self.feed is not None:
+            threads.append(threading.Thread(target=self.run_feed, name='etl-feed', daemon=True))
+        for thread in threads:
+            thread.start()
+        logger.info('ETL запущен в режиме сервиса')
+        while not self.stop.wait(etl_stats_interval):
+            logger.info(f'ETL статистика: {self.stats}')
+        # Текущие циклы дописывают пачки и сохраняют отметки
+        for thread in threads:
+            thread.join()
+        logger.info(f'ETL остановлен, статистика: {self.stats}')
+
+    def run_feed(self) -> None:
+        while not self.stop.is_set():
+            try:
+                self.feed.run(self.stop)
+            except Exception:
+                logger.exception('Лента изменений: ошибка, переподключение')
+                if self.feed.conn is not None:
+                    self.feed.conn.close()
+                self.stop.wait(etl_poll_interval)
+
+    def shutdown(self, *args) -> None:
+        logger.info('Получен сигнал остановки, завершаем текущие циклы')
+        self.stop.set()
+
+    @property
+    def stats(self) -> dict:
+        stats = {worker.name_index: worker.stats for worker in self.workers}
+        if self.feed is not None:
+            stats['feed'] = self.feed.stats
+        return stats
+
+
+if __name__ == '__main__':
+    EtlService(State(JsonFileStorage(state_file))).run()
@@ -1,53 +1,250 @@
+import json
+import multiprocessing
 import psycopg2
 import logging
 
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from contextlib import closing
+from functools import lru_cache, partial
+from typing import Callable, Iterator, Optional
 
 from psycopg2.extensions import connection as _connection
 from psycopg2.extras import DictCursor
 
-from config import dsl, es_conf
-from postgresloader import LoadMovies, LoadGenre, LoadPerson
+from alike import AlikeIndex, sync_alike
+from config import (alike_size, alike_weights, batch_size, dsl, es_bulk,
+                    es_conf, es_force_merge, es_keep_versions, es_schemas,
+                    etl_buffer_size, etl_transform_workers, full_reload,
+                    itersize, state_file)
+from db_query import film_texts
+from embedding import (TextEmbedder, current_embedder, fit_embedder,
+                       publish_embedder, saved_embedder)
+from postgresloader import LoadMovies, LoadGenre, LoadPerson, snapshot
 from utils import backoff
-from es import EsSaver
+from es import EsSaver, IndexValidationError, to_ndjson
+from pipeline import Batch, buffered, ordered_map
 from state import State, JsonFileStorage
 
 logger = logging.getLogger('LoaderStart')
 
 
-def load_from_postgres(pg_conn: _connection, name_index: str) -> list:
-    """Основной метод загрузки данных из Postgres"""
-    if name_index == "movies":
-        postgres_loader = LoadMovies(pg_conn)
-        data = postgres_loader.loader_movies()
-    elif name_index == "genre":
-        postgres_loader = LoadGenre(pg_conn)
-        data = postgres_loader.loader_genre()
-    elif name_index == "person":
-        postgres_loader = LoadPerson(pg_conn)
-        data = postgres_loader.loader_person()
+LOADERS = {
+    'movies': LoadMovies,
+    'genre': LoadGenre,
+    'person': LoadPerson,
+}
+
+
+@lru_cache()
+def get_transform_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул процессов преобразования или None, если ETL_TRANSFORM_WORKERS не задан"""
+    if etl_transform_workers <= 0:
+        return None
+    # spawn: fork из процесса с потоками сервиса может унаследовать чужие блокировки
+    return ProcessPoolExecutor(etl_transform_workers,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def transform_ndjson(transform: Callable, index: str, rows: list) -> Batch:
+    """Пачка строк Postgres сразу в строки bulk-запроса для index, с той же позицией"""
+    return Batch(to_ndjson(transform(rows), index), getattr(rows, 'position', None))
+
+
+def embed(embedder: TextEmbedder, rows: list) -> Batch:
+    """Добавляет строкам пачки векторы текста, посчитанные разом на всю пачку"""
+    vectors = embedder.encode(rows)
+    return Batch((dict(row, embedding=vector.tolist()) for row, vector in zip(rows, vectors)),
+                 getattr(rows, 'position', None))
+
+
+def load_from_postgres(pg_conn: _connection, name_index: str,
+                       ids: Optional[list] = None,
+                       after: Optional[list] = None,
+                       serialize_to: Optional[str] = None,
+                       embedder: Optional[TextEmbedder] = None) -> Iterator[Batch]:
+    """Основной метод загрузки данных из Postgres.
+
+    Чтение, преобразование и запись идут одновременно: между стадиями
+    стоят ограниченные буферы, поэтому память не растёт с размером таблицы.
+    Без ids читаются все документы индекса пачками ключевой пагинации,
+    начиная после позиции after; иначе только перечисленные документы.
+    С serialize_to пачки документов сразу сериализуются в строки
+    bulk-запроса для этого индекса (см. EsSaver.load_ndjson), в пуле
+    процессов, если он настроен. Пул получает пачки по порядку и отдаёт
+    их в том же порядке, так что позиции выгрузки не перемешиваются.
+    Документам с эмбеддингами векторы считает embedder, по умолчанию
+    модель рабочего индекса.
+    """
+    postgres_loader = LOADERS[name_index](
+        pg_conn,
+        batch_size=batch_size[name_index],
+        itersize=itersize,
+    )
+    if embedder is None and postgres_loader.text_embedding:
+        embedder = current_embedder()
+    if ids is None:
+        batches = postgres_loader.extract_chunks(after)
+    else:
+        batches = postgres_loader.extract(postgres_loader.by_ids_query, {'ids': ids})
+
+    def transform(rows: list) -> Batch:
+        return Batch(postgres_loader.transform(rows), getattr(rows, 'position', None))
+
+    rows = buffered(batches, etl_buffer_size)
+    if embedder is not None:
+        rows = buffered(map(partial(embed, embedder), rows), etl_buffer_size)
+    if serialize_to is None:
+        return buffered(map(transform, rows), etl_buffer_size)
+
+    serialize = partial(transform_ndjson, postgres_loader.transform, serialize_to)
+    pool = get_transform_pool()
+    if pool is None:
+        return buffered(map(serialize, rows), etl_buffer_size)
+    # Впереди по две пачки на процесс, чтобы он не простаивал между ними
+    docs = ordered_map(pool, serialize, rows, ahead=2 * etl_transform_workers)
+    return buffered(docs, etl_buffer_size)
+
+
+def write_index(pg_conn: _connection, saver: EsSaver, name_index: str,
+                index: str, ids: Optional[list] = None,
+                after: Optional[list] = None,
+                on_batch: Optional[Callable[[Batch], None]] = None,
+                embedder: Optional[TextEmbedder] = None) -> int:
+    """Переносит документы name_index из Postgres в index.
+
+    С пулом преобразования в ES уходят строки, готовые в его процессах;
+    без пула документы пишет EsSaver.load.
+    """
+    if get_transform_pool() is None:
+        return saver.load(load_from_postgres(pg_conn, name_index, ids, after, embedder=embedder),
+                          name_index=index, on_batch=on_batch)
+    return saver.load_ndjson(load_from_postgres(pg_conn, name_index, ids, after, serialize_to=index,
+                                                embedder=embedder),
+                             name_index=index, on_batch=on_batch)
+
+
+def rebuild_index(pg_conn: _connection, saver: EsSaver, name_index: str,
+                  state: State) -> int:
+    """Полная пересборка в новую версию индекса с переключением алиаса.
+
+    Пока версия заполняется, API читает прежнюю через алиас name_index.
+    После каждой записанной пачки позиция выгрузки сохраняется в state,
+    и прерванная пересборка продолжается в ту же версию с этой позиции.
+    Алиас переключается, только если число документов совпало с Postgres:
+    выгрузка и подсчёт строк идут в одном снимке базы, поэтому изменения
+    во время загрузки расхождения не дают (их перенесёт следующий запуск).
+    Для индекса с эмбеддингами версия получает свою модель, посчитанную
+    по текущим текстам; рабочей она становится вместе с версией.
+    """
+    key = f'rebuild_{name_index}'
+    progress = state.get_state(key)
+    resumed = bool(progress) and saver.client.indices.exists(index=progress['index'])
+    if resumed:
+        index, after = progress['index'], progress['position']
+        logger.info(f'{index}: продолжаем пересборку после {after}')
     else:
-        data = None
-    return data
+        with open(es_schemas[name_index]) as f:
+            index, after = saver.create_index(name_index, json.load(f)), None
+        state.set_state(key, {'index': index, 'position': None})
+
+    def checkpoint(batch: Batch) -> None:
+        state.set_state(key, {'index': index, 'position': batch.position})
+
+    loader = LOADERS[name_index](pg_conn)
+    with snapshot(pg_conn):
+        expected = loader.count(loader.query())
+        embedder = None
+        if loader.text_embedding:
+            embedder = saved_embedder(index) if resumed else None
+            if embedder is None:
+                with pg_conn.cursor() as cursor:
+                    cursor.execute(film_texts)
+                    embedder = fit_embedder(index, cursor.fetchall())
+
+        with saver.bulk_mode(index, state, force_merge=es_force_merge):
+            loaded = write_index(pg_conn, saver, name_index, index, after=after,
+                                 on_batch=checkpoint, embedder=embedder)
+
+    actual = saver.count(index)
+    state.set_state(key, None)
+    if expected != actual:
+        # Недособранная версия не должна копиться рядом с рабочей
+        saver.client.indices.delete(index=index, ignore=404)
+        raise IndexValidationError(
+            f'{index}: в Postgres {expected} записей, в индексе {actual}'
+        )
+    if embedder is not None:
+        publish_embedder(saver, embedder, index)
+    saver.swap_alias(name_index, index, keep=es_keep_versions)
+    return loaded
+
+
+def remove_deleted(pg_conn: _connection, saver: EsSaver, name_index: str) -> int:
+    """Удаляет из индекса документы строк, которых больше нет в Postgres.
+
+    Удаления отметки не показывают. После инкрементальной загрузки в индексе
+    есть все документы источника, поэтому лишние видны по числу документов:
+    только тогда id индекса сверяются с Postgres. Возвращает число удалённых.
+    """
+    loader = LOADERS[name_index](pg_conn)
+    if saver.count(name_index) <= loader.count(loader.ids_query):
+        return 0
+    with pg_conn.cursor() as cursor:
+        cursor.execute(loader.ids_query)
+        present = {str(row[0]) for row in cursor}
+    deleted = saver.delete([doc_id for doc_id in saver.ids(name_index) if doc_id not in present],
+                           name_index)
+    logger.info(f'{name_index}: удалено документов {deleted}')
+    return deleted
+
+
+def sync_index(pg_conn: _connection, saver: EsSaver, name_index: str,
+               state: State, full: bool = False) -> int:
+    """Переносит в индекс изменения с прошлого запуска.
+
+    Отметки берутся до выборки, поэтому строки, изменённые во время загрузки,
+    попадут в следующий запуск. Документы удалённых строк убирает
+    remove_deleted; удалённые связи фильмов видит только лента изменений.
+    Без сохранённых отметок индекс пересобирается, как и индекс
+    с эмбеддингами без рабочей модели.
+    Возвращает число записанных документов.
+    """
+    loader = LOADERS[name_index](pg_conn)
+    until = loader.marks()
+    since = state.get_state(name_index)
+    indexed = 0
+    if loader.text_embedding and current_embedder() is None:
+        full = True
+    if full or not since or any(table not in since for table in until):
+        indexed = rebuild_index(pg_conn, saver, name_index, state)
+    else:
+        ids = loader.changed_ids(since, until)
+        logger.info(f'{name_index}: изменилось документов {len(ids)}')
+        if ids:
+            indexed = write_index(pg_conn, saver, name_index, name_index, ids)
+        remove_deleted(pg_conn, saver, name_index)
+    state.set_state(name_index, until)
+    return indexed
 
 
 if __name__ == '__main__':
+    state = State(JsonFileStorage(state_file))
+
     @backoff()
-    def query_postgres_film(name_index) -> list:
+    def save_elastic(name_index: str) -> None:
         with closing(psycopg2.connect(**dsl, cursor_factory=DictCursor)) as pg_conn:
             logger.info(f'{datetime.now()}\n\nPostgreSQL connection is open. Start load {name_index} data')
-            load_pq = load_from_postgres(pg_conn, name_index)
-        return load_pq
-
+            logger.info(f'{datetime.now()}\n\nElasticSearch connection is open. Start load {name_index} data')
+            sync_index(pg_conn, EsSaver(es_conf, **es_bulk), name_index, state, full=full_reload)
 
-    def save_elastic(name_index: str) -> None:
-        logger.info(f'{datetime.now()}\n\nElasticSearch connection is open. Start load {name_index} data')
-        EsSaver(es_conf).load(query_postgres_film(name_index), name_index=name_index)
+    @backoff()
+    def save_alike() -> None:
+        with closing(psycopg2.connect(**dsl, cursor_factory=DictCursor)) as pg_conn:
+            sync_alike(pg_conn, EsSaver(es_conf, **es_bulk), AlikeIndex(alike_size, alike_weights))
 
     save_elastic(name_index='movies')
     save_elastic(name_index='genre')
     save_elastic(name_index='person')
-
-    State(JsonFileStorage('PostgresDataState.txt')).set_state(str('my_key'), value=str(datetime.now()))
+    save_alike()
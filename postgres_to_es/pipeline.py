@@ -0,0 +1,83 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Iterable, Iterator, Optional
+
+_DONE = object()
+
+
+class Batch(list):
+    """Пачка строк или документов и позиция выгрузки сразу после неё"""
+
+    def __init__(self, items: Iterable = (), position: Optional[list] = None):
+        super().__init__(items)
+        self.position = position
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def buffered(iterable: Iterable, maxsize: int = 4) -> Iterator:
+    """Прогоняет iterable в фоновом потоке, держа впереди не больше maxsize элементов.
+
+    Так соседние стадии ETL (чтение из Postgres, преобразование, запись в ES)
+    работают одновременно, а память ограничена размером буфера.
+    """
+    buffer = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as exc:
+            put(_Failure(exc))
+        else:
+            put(_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def ordered_map(executor: Executor, fn: Callable, iterable: Iterable,
+                ahead: int = 4) -> Iterator:
+    """Как executor.map, но в работе не больше ahead задач.
+
+    Executor.map забирает весь iterable сразу; здесь следующая задача
+    ставится только после выдачи результата, и результаты идут по порядку.
+    """
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -1,124 +1,219 @@
-import re
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterator, Optional
+from uuid import uuid4
 
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
 from psycopg2.extensions import connection as _connection
 from psycopg2.extras import DictCursor
-from state import JsonFileStorage, State
-from db_query import load_person_q, load_film_id, full_load, query_all_genre, load_person_role
+from db_query import (changed_film_ids, changed_genre_ids, changed_person_ids,
+                      film_by_ids, film_chunk, film_ids, full_load,
+                      genre_by_ids, genre_chunk, genre_ids, load_person_role,
+                      marks_query, person_by_ids, person_chunk, person_ids,
+                      query_all_genre)
+from pipeline import Batch
 from schemas import Film, Genre, Person
 
+# Позиция перед первой строкой любой таблицы
+START_POSITION = ['-infinity', '00000000-0000-0000-0000-000000000000']
+# Отметка таблицы без строк: раньше любой updated_at
+NO_MARK = '-infinity'
 
-class PostgresConnect:
-    def __init__(self, pg_conn: _connection):
-        self.conn = pg_conn
-        self.cursor = self.conn.cursor(cursor_factory=DictCursor)
-        self.batch_size = 100
 
+@contextmanager
+def snapshot(pg_conn: _connection) -> Iterator[None]:
+    """Запросы внутри блока идут одной транзакцией REPEATABLE READ только
+    на чтение и видят один снимок базы, сколько бы ни длилась выгрузка.
+    """
+    pg_conn.commit()
+    isolation_level, readonly = pg_conn.isolation_level, pg_conn.readonly
+    pg_conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    try:
+        yield
+    finally:
+        if not pg_conn.closed:
+            pg_conn.rollback()
+            pg_conn.isolation_level, pg_conn.readonly = isolation_level, readonly
 
-class PostgresLoader(PostgresConnect):
-    def __init__(self, pg_conn: _connection, state_key='my_key'):
-        super().__init__(pg_conn)
-        self.key = state_key
-        self.state_key = State(JsonFileStorage('PostgresDataState.txt')).get_state(state_key)
-        self.data = []
-
-    def load_person_id(self) -> str:
-        """Вложенный запрос на получение id персон, думаю функция тут лишняя """
-        return load_person_q
-
-    def load_film_work_id(self) -> str:
-        """Вложенный запрос на получение id film_work"""
-        query = load_film_id % self.load_person_id()
-        if self.state_key is None:
-            return query
-        inx = query.rfind(
-            f'WHERE pfw.person_id IN ({self.load_person_id()})'
-        )
-        return f"{query[:inx]} AND updated_at > '{self.state_key}' {query[inx:]}"
-
-    def load_all_film_work_person(self) -> str:
-        return full_load % self.load_film_work_id()
-
-    def load_genre(self) -> str:
-        if self.state_key is None:
-            return query_all_genre
-        inx = re.search('FROM content.genre', query_all_genre).end()
-        return f"{query_all_genre[:inx]} WHERE updated_at > '{self.state_key}' {query_all_genre[inx:]}"
-
-    def load_person(self) -> str:
-        query = load_person_role
-        if self.state_key is None:
-            return query
-        inx = re.search('as pfw ON p.id = pfw.person_id', query).end()
-        return f"{query[:inx]} WHERE updated_at > '{self.state_key}' {query[inx:]}"
 
+class PostgresConnect:
+    def __init__(self, pg_conn: _connection, batch_size: int = 100,
+                 itersize: int = 2000):
+        self.conn = pg_conn
+        self.batch_size = batch_size
+        self.itersize = itersize
+
+    def extract(self, query: str, params: Optional[dict] = None) -> Iterator[list]:
+        """Генератор пачек строк по batch_size штук.
+
+        Запрос идёт через именованный (серверный) курсор: Postgres отдаёт
+        результат порциями по itersize строк, а не целиком при execute.
+        """
+        with self.conn.cursor(name=f'etl_{uuid4().hex}',
+                              cursor_factory=DictCursor) as cursor:
+            cursor.itersize = self.itersize
+            cursor.execute(query, params)
+            rows = iter(cursor)
+
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                yield batch
+
+    def count(self, query: str) -> int:
+        """Сколько строк вернёт запрос, без выборки самих строк"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM ({query.strip().rstrip(';')}) AS q")
+            return cursor.fetchone()[0]
 
-class LoadMovies(PostgresLoader):
-
-    def loader_movies(self) -> list:
-        """Запрос на получение всех данных по фильмам"""
-        self.cursor.execute(self.load_all_film_work_person())
 
+class PostgresLoader(PostgresConnect):
+    """Выборка документов одного индекса: всех или только изменившихся.
+
+    sources - таблицы, изменения в которых меняют документы индекса.
+    Их отметки хранятся в состоянии и сравниваются по окну (since, until].
+    """
+    sources: tuple = ()
+    # Считать ли эмбеддинги текста (embedding.TextEmbedder) для документов
+    text_embedding: bool = False
+    full_query: str
+    chunk_query: str
+    changed_query: str
+    by_ids_query: str
+    # id документов, которые должны быть в индексе
+    ids_query: str
+
+    def query(self) -> str:
+        return self.full_query
+
+    def extract_chunks(self, after: Optional[list] = None) -> Iterator[Batch]:
+        """Полная выгрузка ключевой пагинацией по (updated_at, id).
+
+        Каждая пачка - отдельный запрос с LIMIT batch_size по индексу, а её
+        position - ключ последней строки: с него выгрузку можно продолжить.
+        """
+        position = after or START_POSITION
         while True:
-            rows = self.cursor.fetchmany(self.batch_size)
+            with self.conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(self.chunk_query, {
+                    'updated_at': position[0],
+                    'id': position[1],
+                    'limit': self.batch_size,
+                })
+                rows = cursor.fetchall()
             if not rows:
-                break
-
-            for row in rows:
-                d = Film(
-                    id              = dict(row).get('id'),
-                    imdb_rating     = dict(row).get('rating'),
-                    genre           = dict(row).get('genre'),
-                    title           = dict(row).get('title'),
-                    description     = dict(row).get('description'),
-                    director        = dict(row).get('director'),
-                    actors_names    = dict(row).get('actors_names'),
-                    writers_names   = dict(row).get('writers_names'),
-                    actors          = dict(row).get('actors'),
-                    writers         = dict(row).get('writers'),
-                )
-                self.data.append(d.dict())
-
-        return self.data
+                return
+            position = [rows[-1]['updated_at'].isoformat(), str(rows[-1]['id'])]
+            yield Batch(rows, position)
+            if len(rows) < self.batch_size:
+                return
+
+    def marks(self) -> dict:
+        """Текущие отметки таблиц-источников, верхняя граница окна изменений.
+
+        У пустой таблицы отметка '-infinity': с NULL сравнение updated_at >
+        отметки не выполнялось бы никогда, и первые строки таблицы не попали
+        бы в индекс.
+        """
+        with self.conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute(marks_query)
+            row = cursor.fetchone()
+        return {
+            table: row[table].isoformat() if row[table] else NO_MARK
+            for table in self.sources
+        }
+
+    def changed_ids(self, since: dict, until: dict) -> list:
+        """id документов, затронутых изменениями в окне (since, until]"""
+        params = {}
+        for table in self.sources:
+            # None остаётся в состоянии, сохранённом до отметки NO_MARK
+            params[table] = since[table] or NO_MARK
+            params[f'{table}_until'] = until[table]
+        with self.conn.cursor() as cursor:
+            cursor.execute(self.changed_query, params)
+            return [row[0] for row in cursor]
 
 
-class LoadGenre(PostgresLoader):
-    def loader_genre(self) -> list:
-        """Запрос на получение всех жанров"""
-        self.cursor.execute(self.load_genre())
-
-        while True:
-            rows = self.cursor.fetchmany(self.batch_size)
-            if not rows:
-                break
+class LoadMovies(PostgresLoader):
+    sources = ('film_work', 'person', 'genre', 'person_film_work', 'genre_film_work')
+    full_query = full_load
+    chunk_query = film_chunk
+    changed_query = changed_film_ids
+    by_ids_query = film_by_ids
+    ids_query = film_ids
+    text_embedding = True
+
+    @staticmethod
+    def transform(rows: list) -> list:
+        data = []
+        for row in rows:
+            row = dict(row)
+            d = Film(
+                id              = row.get('id'),
+                imdb_rating     = row.get('rating'),
+                genre           = row.get('genre'),
+                title           = row.get('title'),
+                description     = row.get('description'),
+                director        = row.get('director'),
+                actors_names    = row.get('actors_names'),
+                writers_names   = row.get('writers_names'),
+                actors          = row.get('actors'),
+                writers         = row.get('writers'),
+                embedding       = row.get('embedding'),
+            )
+            doc = d.dict()
+            # Без модели вектора нет, а null поле dense_vector не принимает
+            if doc['embedding'] is None:
+                del doc['embedding']
+            data.append(doc)
+        return data
 
-            for row in rows:
-                d = Genre(
-                    id              = dict(row).get('id'),
-                    name            = dict(row).get('name'),
-                    description     = dict(row).get('description'),
-                )
-                self.data.append(d.dict())
 
-        return self.data
+class LoadGenre(PostgresLoader):
+    sources = ('genre',)
+    full_query = query_all_genre
+    chunk_query = genre_chunk
+    changed_query = changed_genre_ids
+    by_ids_query = genre_by_ids
+    ids_query = genre_ids
+
+    @staticmethod
+    def transform(rows: list) -> list:
+        data = []
+        for row in rows:
+            row = dict(row)
+            d = Genre(
+                id              = row.get('id'),
+                name            = row.get('name'),
+                description     = row.get('description'),
+            )
+            data.append(d.dict())
+        return data
 
 
 class LoadPerson(PostgresLoader):
-    def loader_person(self) -> list:
-        """Запрос на получение всех персон"""
-        self.cursor.execute(self.load_person())
-
-        while True:
-            rows = self.cursor.fetchmany(self.batch_size)
-            if not rows:
-                break
-
-            for row in rows:
-                d = Person(
-                    id              = dict(row).get('id'),
-                    full_name       = dict(row).get('full_name'),
-                    birth_date      = dict(row).get('birth_date'),
-                    role            = dict(row).get('role').replace('{', '').replace('}', ''),
-                    film_ids        = dict(row).get('film_ids').replace('{', '').replace('}', '').split(',')
-                )
-                self.data.append(d.dict())
-        return self.data
+    # Названия и рейтинги фильмов встроены в документы персон
+    sources = ('person', 'person_film_work', 'film_work')
+    full_query = load_person_role
+    chunk_query = person_chunk
+    changed_query = changed_person_ids
+    by_ids_query = person_by_ids
+    ids_query = person_ids
+
+    @staticmethod
+    def transform(rows: list) -> list:
+        data = []
+        for row in rows:
+            row = dict(row)
+            d = Person(
+                id              = row.get('id'),
+                full_name       = row.get('full_name'),
+                birth_date      = row.get('birth_date'),
+                role            = ','.join(role for role in row.get('role') if role),
+                film_ids        = [film_id for film_id in row.get('film_ids') if film_id],
+                films           = row.get('films') or [],
+            )
+            data.append(d.dict())
+        return data
@@ -32,6 +32,7 @@ class Film(Orjson):
     writers_names   : Optional[List[str]] = None
     actors          : Optional[List[Dict[OBJ_ID, OBJ_NAME]]] = None
     writers         : Optional[List[Dict[OBJ_ID, OBJ_NAME]]] = None
+    embedding       : Optional[List[float]] = None
 
 
 class Genre(Orjson):
@@ -40,9 +41,17 @@ class Genre(Orjson):
     description     : Optional[str] = None
 
 
+class PersonFilm(Orjson):
+    id              : Union[int, str, UUID]
+    title           : str
+    imdb_rating     : Optional[float] = None
+    role            : Optional[str] = None
+
+
 class Person(Orjson):
     id              : Union[int, str, UUID]
     full_name       : str
     birth_date      : Optional[date] = None
     role            : Optional[str] = None
     film_ids        : Optional[List[Union[int, str, UUID]]]
+    films           : Optional[List[PersonFilm]] = None
@@ -0,0 +1,40 @@
+-- Лента изменений для ETL: триггеры пишут id затронутых строк в
+-- content.change_log и будят слушателя через NOTIFY content_changes.
+-- Уведомление только сигнал, источник правды - таблица: записи в ней
+-- переживают простой ETL и удаляются им после обработки.
+CREATE TABLE IF NOT EXISTS content.change_log (
+    id bigserial PRIMARY KEY,
+    table_name text NOT NULL,
+    ids jsonb NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION content.log_change() RETURNS trigger AS $$
+DECLARE
+    row jsonb := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+BEGIN
+    INSERT INTO content.change_log (table_name, ids)
+    VALUES (TG_TABLE_NAME, jsonb_strip_nulls(jsonb_build_object(
+        'id', row->'id',
+        'film_work_id', row->'film_work_id',
+        'person_id', row->'person_id',
+        'genre_id', row->'genre_id'
+    )));
+    -- Одинаковые уведомления в одной транзакции Postgres сливает в одно
+    PERFORM pg_notify('content_changes', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    name text;
+BEGIN
+    FOREACH name IN ARRAY ARRAY['film_work', 'person', 'genre', 'person_film_work', 'genre_film_work'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I_change_log ON content.%I', name, name);
+        EXECUTE format(
+            'CREATE TRIGGER %I_change_log AFTER INSERT OR UPDATE OR DELETE ON content.%I '
+            'FOR EACH ROW EXECUTE FUNCTION content.log_change()', name, name);
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,20 @@
+-- Индексы для ETL: выборка изменений по отметкам updated_at/created_at,
+-- ключевая пагинация по (changed_at, id) и переход от персоны/жанра к фильмам
+-- Ключ строки - db_query.changed_at: updated_at, а если он NULL, created_at.
+-- Индексы прежних версий по (updated_at) и (updated_at, id) заменены
+DROP INDEX IF EXISTS content.film_work_updated_at_idx;
+DROP INDEX IF EXISTS content.person_updated_at_idx;
+DROP INDEX IF EXISTS content.genre_updated_at_idx;
+DROP INDEX IF EXISTS content.film_work_updated_at_id_idx;
+DROP INDEX IF EXISTS content.person_updated_at_id_idx;
+DROP INDEX IF EXISTS content.genre_updated_at_id_idx;
+CREATE INDEX IF NOT EXISTS film_work_changed_at_id_idx
+    ON content.film_work ((COALESCE(updated_at, created_at, 'epoch')), id);
+CREATE INDEX IF NOT EXISTS person_changed_at_id_idx
+    ON content.person ((COALESCE(updated_at, created_at, 'epoch')), id);
+CREATE INDEX IF NOT EXISTS genre_changed_at_id_idx
+    ON content.genre ((COALESCE(updated_at, created_at, 'epoch')), id);
+CREATE INDEX IF NOT EXISTS person_film_work_created_at_idx ON content.person_film_work (created_at);
+CREATE INDEX IF NOT EXISTS genre_film_work_created_at_idx ON content.genre_film_work (created_at);
+CREATE INDEX IF NOT EXISTS person_film_work_person_idx ON content.person_film_work (person_id);
+CREATE INDEX IF NOT EXISTS genre_film_work_genre_idx ON content.genre_film_work (genre_id);
@@ -1,6 +1,7 @@
 import abc
 import json
 import logging
+import threading
 from json import JSONDecodeError
 from typing import Optional, Any
 
@@ -50,6 +51,8 @@ class State:
     def __init__(self, storage: BaseStorage):
         self.storage = storage
         self.state = self.retrieve_state()
+        # Состояние общее для потоков ETL, файл пишется целиком
+        self._lock = threading.Lock()
 
     def retrieve_state(self) -> dict:
         data = self.storage.retrieve_state()
@@ -59,9 +62,9 @@ class State:
 
     def set_state(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа"""
-        self.state[key] = value
-
-        self.storage.save_state(self.state)
+        with self._lock:
+            self.state[key] = value
+            self.storage.save_state(self.state)
 
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу"""
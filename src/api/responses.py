@@ -0,0 +1,14 @@
+from fastapi.responses import Response
+
+
+class RawJSONResponse(Response):
+    """Sends an already serialized JSON payload without touching it."""
+
+    media_type = 'application/json'
+
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def cursor_headers(next_cursor: str = None) -> dict or None:
+    return {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
@@ -1,93 +1,100 @@
 from http import HTTPStatus
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 
+from api.responses import RawJSONResponse, cursor_headers
+from core import config
 from models.models import Film, FilmShort
-from services.film import FilmService, get_film_service
+from services.cursor import InvalidCursor
+from services.film import FilmService, SearchMode, get_film_service
 
 router = APIRouter()
 
 
-@router.get('/', response_model=list[Film], response_model_exclude_unset=True)
+@router.get('/', response_model=list[FilmShort],
+            response_model_exclude_unset=True)
 async def films_sorted(sort: str = None,
                        filter_genre: str = None,
-                       page_number: int = 0,
-                       page_size: int = 20,
+                       page_number: int = Query(0, ge=0),
+                       page_size: int = Query(20, gt=0, le=config.MAX_PAGE_SIZE),
+                       cursor: str = None,
                        film_service: FilmService = Depends(get_film_service)):
+    if cursor is not None:
+        try:
+            film_list, next_cursor = await film_service.get_page(
+                cursor=cursor,
+                sort_field=sort,
+                filter_genre=filter_genre,
+                page_size=page_size,
+                shape=FilmShort,
+            )
+        except InvalidCursor:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                                detail='invalid cursor')
+        if not film_list:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
+        return RawJSONResponse(film_list, headers=cursor_headers(next_cursor))
+
     film_list = await film_service.get_request(
         sort_field = sort,
         filter_genre = filter_genre,
         page_number = page_number,
         page_size = page_size,
+        shape=FilmShort,
         )
     if not film_list:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    return [FilmShort(id=film.id,
-                      title=film.title,
-                      imdb_rating=film.imdb_rating) for film in film_list]
+    return RawJSONResponse(film_list)
 
 
 @router.get('/search/{film_search_string}', response_model=list[FilmShort],
             response_model_exclude_unset=True)
 async def films_search(film_search_string: str,
+                       mode: SearchMode = SearchMode.text,
                        film_service: FilmService = Depends(
-                           get_film_service)) -> list[FilmShort]:
+                           get_film_service)) -> RawJSONResponse:
 
-    film_list = await film_service.get_request(
-        q=film_search_string
+    film_list = await film_service.search(
+        q=film_search_string,
+        mode=mode,
+        shape=FilmShort,
     )
     if not film_list:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    return [FilmShort(id=film.id,
-                      title=film.title,
-                      imdb_rating=film.imdb_rating) for film in film_list]
+    return RawJSONResponse(film_list)
 
 
 @router.get('/{film_id}', response_model=Film,
             response_model_exclude_unset=True)
 async def film_details(film_id: str,
                        film_service: FilmService = Depends(
-                           get_film_service)) -> Film:
-    film_list = await film_service.get_request(q=film_id)
-    if not film_list:
+                           get_film_service)) -> RawJSONResponse:
+    film = await film_service.get_by_id(film_id, shape=Film)
+    if not film:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    film = film_list[0]
-    return Film(id=film.id,
-                imdb_rating=film.imdb_rating,
-                genre=film.genre,
-                title=film.title,
-                description=film.description,
-                director=film.director,
-                actors_names=film.actors_names,
-                writers_names=film.writers_names,
-                actors=film.actors,
-                writers=film.writers,)
+    return RawJSONResponse(film)
 
 
 @router.get('/{film_id}/alike', response_model=list[FilmShort],
             response_model_exclude_unset=True)
-async def film_alike(film_id: str, film_service: FilmService = Depends(get_film_service)) -> list[FilmShort]:
+async def film_alike(film_id: str, film_service: FilmService = Depends(get_film_service)) -> RawJSONResponse:
     film_list = await film_service.get_film_alike(film_id=film_id)
     if not film_list:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    return [FilmShort(id=film.id,
-                      title=film.title,
-                      imdb_rating=film.imdb_rating) for film in film_list]
+    return RawJSONResponse(film_list)
 
 
 @router.get('/genre/{genre_id}', response_model=list[FilmShort],
             response_model_exclude_unset=True)
 async def popular_in_genre(genre_id: str,
                            film_service: FilmService = Depends(
-                               get_film_service)) -> list[FilmShort]:
+                               get_film_service)) -> RawJSONResponse:
 
     film_list = await film_service.get_request(
         filter_genre=genre_id,
         page_number=0,
         page_size=30,
-        q=genre_id)
+        shape=FilmShort)
     if not film_list:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    return [FilmShort(id=film.id,
-                      title=film.title,
-                      imdb_rating=film.imdb_rating) for film in film_list]
+    return RawJSONResponse(film_list)
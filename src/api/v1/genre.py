@@ -1,7 +1,9 @@
 from http import HTTPStatus
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 
+from api.responses import RawJSONResponse
+from core import config
 from models.models import Genre
 from services.genre import GenreService, get_genre_service
 
@@ -12,27 +14,20 @@ router = APIRouter()
             response_model_exclude_unset=True)
 async def genre_details(genre_id: str,
                         genre_service: GenreService = Depends(
-                            get_genre_service)) -> Genre:
-    genre = await genre_service.get_request(q=genre_id)
+                            get_genre_service)) -> RawJSONResponse:
+    genre = await genre_service.get_by_id(genre_id)
     if not genre:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    genre = genre[0]
-    return Genre(id=genre.id,
-                 name=genre.name,
-                 description=genre.description
-                 )
+    return RawJSONResponse(genre)
 
 
 @router.get('/', response_model=list[Genre], response_model_exclude_unset=True)
 async def genre_list(
-        page_number: int = 0,
-        page_size: int = 50,
-        genre_service: GenreService = Depends(get_genre_service)) -> list[
-    Genre]:
+        page_number: int = Query(0, ge=0),
+        page_size: int = Query(50, gt=0, le=config.MAX_PAGE_SIZE),
+        genre_service: GenreService = Depends(get_genre_service)) -> RawJSONResponse:
     genre_list = await genre_service.get_request(page_number=page_number,
                                                  page_size=page_size)
     if not genre_list:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    return [Genre(id=genre.id,
-                  name=genre.name,
-                  description=genre.description) for genre in genre_list]
+    return RawJSONResponse(genre_list)
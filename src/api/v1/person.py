@@ -1,8 +1,11 @@
 from http import HTTPStatus
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 
-from models.models import Person
+from api.responses import RawJSONResponse, cursor_headers
+from core import config
+from models.models import Person, PersonFilm, PersonShort
+from services.cursor import InvalidCursor
 from services.person import PersonService, get_person_service
 
 router = APIRouter()
@@ -12,50 +15,65 @@ router = APIRouter()
             response_model_exclude_unset=True)
 async def person_details(person_id: str,
                          person_service: PersonService = Depends(
-                             get_person_service)) -> Person:
-    person = await person_service.get_request(q=person_id)
+                             get_person_service)) -> RawJSONResponse:
+    person = await person_service.get_by_id(person_id)
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    person = person[0]
-    return Person(id=person.id,
-                  full_name=person.full_name,
-                  birth_date=person.birth_date,
-                  role=person.role,
-                  film_ids=person.film_ids)
+    return RawJSONResponse(person)
 
 
-@router.get('/', response_model=list[Person],
+@router.get('/', response_model=list[PersonShort],
             response_model_exclude_unset=True)
 async def person_list(
-        page_number: int = 0,
-        page_size: int = 20,
-        person_service: PersonService = Depends(get_person_service)) -> list[
-    Person]:
+        page_number: int = Query(0, ge=0),
+        page_size: int = Query(20, gt=0, le=config.MAX_PAGE_SIZE),
+        cursor: str = None,
+        person_service: PersonService = Depends(get_person_service)) -> RawJSONResponse:
+    if cursor is not None:
+        try:
+            person_list, next_cursor = await person_service.get_page(
+                cursor=cursor,
+                page_size=page_size,
+                shape=PersonShort,
+            )
+        except InvalidCursor:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                                detail='invalid cursor')
+        if not person_list:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
+        return RawJSONResponse(person_list,
+                               headers=cursor_headers(next_cursor))
+
     person_list = await person_service.get_request(page_number=page_number,
-                                                   page_size=page_size)
+                                                   page_size=page_size,
+                                                   shape=PersonShort)
 
     if not person_list:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    return [Person(id=person.id,
-                   full_name=person.full_name,
-                   birth_date=person.birth_date,
-                   role=person.role,
-                   film_ids=person.film_ids) for person in person_list]
+    return RawJSONResponse(person_list)
 
 
-@router.get('/search/{person_search_string}', response_model=list[Person],
+@router.get('/search/{person_search_string}', response_model=list[PersonShort],
             response_model_exclude_unset=True)
 async def films_search(person_search_string: str,
                        person_service: PersonService = Depends(
-                           get_person_service)) -> list[Person]:
+                           get_person_service)) -> RawJSONResponse:
     person_list = await person_service.get_request(
-        q=person_search_string
+        q=person_search_string,
+        shape=PersonShort,
     )
 
     if not person_list:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
-    return [Person(id=person.id,
-                   full_name=person.full_name,
-                   birth_date=person.birth_date,
-                   role=person.role,
-                   film_ids=person.film_ids) for person in person_list]
+    return RawJSONResponse(person_list)
+
+
+@router.get('/{person_id}/film', response_model=list[PersonFilm],
+            response_model_exclude_unset=True)
+async def person_films(person_id: str,
+                       person_service: PersonService = Depends(
+                           get_person_service)) -> RawJSONResponse:
+    film_list = await person_service.get_person_films(person_id)
+    if not film_list:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
+    return RawJSONResponse(film_list)
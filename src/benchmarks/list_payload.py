@@ -0,0 +1,82 @@
+"""Per-request CPU cost of a cached list endpoint hit.
+
+Compares the old path (parse the cached models, rebuild ``FilmShort`` objects,
+let FastAPI validate and serialize them) with the pre-serialized payload
+path. Run from ``src``: ``python -m benchmarks.list_payload``.
+"""
+import asyncio
+import json
+import time
+import uuid
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import parse_raw_as
+from pydantic.json import pydantic_encoder
+
+from api.responses import RawJSONResponse
+from models.models import Film, FilmShort
+from services.base import BaseService
+
+ROUNDS = 2000
+
+
+def make_films(count: int) -> list[Film]:
+    person = [{'id': str(uuid.uuid4()), 'name': 'Some Person'}] * 4
+    return [
+        Film(id=str(uuid.uuid4()),
+             imdb_rating=7.5,
+             genre=[{'id': str(uuid.uuid4()), 'name': 'Drama'}] * 3,
+             title=f'Film number {i}',
+             description='A fairly long description of the film. ' * 5,
+             director=person[:1],
+             actors_names=['Some Person'] * 4,
+             writers_names=['Some Person'] * 4,
+             actors=person,
+             writers=person)
+        for i in range(count)
+    ]
+
+
+async def before(cached: bytes, field) -> bytes:
+    film_list = parse_raw_as(list[Film], cached)
+    content = [FilmShort(id=film.id,
+                         title=film.title,
+                         imdb_rating=film.imdb_rating) for film in film_list]
+    content = await serialize_response(field=field,
+                                       response_content=content,
+                                       exclude_unset=True)
+    return ORJSONResponse(content).body
+
+
+async def after(cached: bytes) -> bytes:
+    return RawJSONResponse(cached).body
+
+
+async def measure(name: str, func, *args) -> float:
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        await func(*args)
+    per_request = (time.process_time() - start) / ROUNDS * 1e6
+    print(f'{name:>8}: {per_request:8.1f} us CPU per request')
+    return per_request
+
+
+async def main():
+    field = create_response_field(name='films', type_=list[FilmShort])
+    for page_size in (20, 50):
+        films = make_films(page_size)
+        old_cached = json.dumps(films, default=pydantic_encoder).encode()
+        new_cached = BaseService._dump(films, shape=FilmShort)
+        assert orjson.loads(await before(old_cached, field)) == orjson.loads(
+            await after(new_cached))
+        print(f'page_size={page_size}')
+        old = await measure('before', before, old_cached, field)
+        new = await measure('after', after, new_cached)
+        print(f'{"speedup":>8}: {old / new:8.1f}x')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
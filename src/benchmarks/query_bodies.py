@@ -0,0 +1,63 @@
+"""Throughput of request body construction.
+
+Compares building nested dicts per request and serializing them the way the
+ES client does with rendering pre-compiled query templates.
+Run from ``src``: ``python -m benchmarks.query_bodies``.
+"""
+import json
+import time
+
+from services.query_builder import QueryBuilder, SearchParams
+
+ROUNDS = 100_000
+
+
+def dict_search(q: str, fields: list, source: list) -> str:
+    body = {'query': {'multi_match': {'query': q, 'fields': fields}},
+            '_source': source}
+    return json.dumps(body)
+
+
+def dict_genre_page(genre: str, page_number: int, page_size: int) -> str:
+    body = {
+        'query': {'bool': {'filter': [{'nested': {
+            'path': 'genre',
+            'query': {'term': {'genre.id': genre}},
+        }}]}},
+        'sort': [{'imdb_rating': 'desc'}],
+        'from': page_number * page_size,
+        'size': page_size,
+        '_source': ['id', 'title', 'imdb_rating'],
+    }
+    return json.dumps(body)
+
+
+def measure(name: str, func) -> None:
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>24}: {ROUNDS / elapsed:12,.0f} bodies/s')
+
+
+def main():
+    builder = QueryBuilder()
+    fields = ['id', 'title', 'genre.id']
+    source = ['id', 'title', 'imdb_rating']
+    genre = '120a21cf-9097-479e-904a-13dd7198c1dd'
+
+    measure('search: dict + json', lambda i: dict_search('star', fields, source))
+    measure('search: template', lambda i: builder.search(SearchParams(
+        q='star', fields=fields, source=source)))
+    measure('genre page: dict + json',
+            lambda i: dict_genre_page(genre, i % 10, 20))
+    measure('genre page: template', lambda i: builder.search(SearchParams(
+        filter_genre=genre,
+        sort=[{'imdb_rating': 'desc'}],
+        page_number=i % 10,
+        page_size=20,
+        source=source)))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,3 +24,32 @@ POSTGRES_HOST = os.getenv('POSTGRES_HOST')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT')
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# In-process cache tier in front of Redis
+LOCAL_CACHE_MAX_ITEMS = int(os.getenv('LOCAL_CACHE_MAX_ITEMS', 500))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv('LOCAL_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+LOCAL_CACHE_TTL = int(os.getenv('LOCAL_CACHE_TTL', 10))
+
+# Redis cache lifetime. With stale-while-revalidate enabled CACHE_EXPIRE is
+# the soft TTL and CACHE_STALE_EXPIRE the hard one.
+CACHE_EXPIRE = int(os.getenv('CACHE_EXPIRE', 60 * 5))
+CACHE_STALE_WHILE_REVALIDATE = os.getenv(
+    'CACHE_STALE_WHILE_REVALIDATE', 'False').lower() in ('true', '1')
+CACHE_STALE_EXPIRE = int(os.getenv('CACHE_STALE_EXPIRE', 60 * 30))
+CACHE_REFRESH_CONCURRENCY = int(os.getenv('CACHE_REFRESH_CONCURRENCY', 8))
+
+# Upper bound of the page_size query parameter of list endpoints
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 100))
+
+# Cursor pagination over a point in time (ES >= 7.10)
+ELASTIC_CURSOR_PIT = os.getenv('ELASTIC_CURSOR_PIT', 'False').lower() in ('true', '1')
+ELASTIC_PIT_KEEP_ALIVE = os.getenv('ELASTIC_PIT_KEEP_ALIVE', '1m')
+
+# Alike films precomputed by the ETL, one document per film
+ELASTIC_ALIKE_INDEX = os.getenv('ELASTIC_ALIKE_INDEX', 'movies_alike')
+
+# Vocabulary of the ETL text embeddings: a query vector is the sum of its
+# words' vectors. In hybrid search the vector similarity (0..2) is added to
+# the text score with this weight.
+ELASTIC_TERMS_INDEX = os.getenv('ELASTIC_TERMS_INDEX', 'movies_terms')
+HYBRID_VECTOR_WEIGHT = float(os.getenv('HYBRID_VECTOR_WEIGHT', 5))
@@ -42,9 +42,25 @@ class Genre(Orjson):
     description: Optional[str] = None
 
 
+class PersonFilm(BaseModel):
+    id: str
+    title: str
+    imdb_rating: Optional[float] = None
+    role: Optional[str] = None
+
+
+class PersonShort(BaseModel):
+    id: str
+    full_name: str
+    birth_date: Optional[date] = None
+    role: Optional[str] = None
+    film_ids: list[str]
+
+
 class Person(Orjson):
     id: str
     full_name: str
     birth_date: Optional[date] = None
     role: Optional[str] = None
     film_ids: list[str]
+    films: Optional[list[PersonFilm]] = None
@@ -1,14 +1,21 @@
-import json
 from abc import abstractmethod
+from typing import Awaitable, Callable, Type
 
-from pydantic.json import pydantic_encoder
-from pydantic import parse_raw_as
+import orjson
+from elasticsearch import NotFoundError, RequestError
+from pydantic import BaseModel
+
+from core import config
 from services.caching import Cacheable
+from services.cursor import InvalidCursor, decode_cursor, encode_cursor
 from models.models import Film
 from services.es_search import EsService
+from services.query_builder import SearchParams
+from services.revalidate import get_revalidator, pack, unpack
+from services.singleflight import SingleFlight
 
 
-CACHE_EXPIRE = 60 * 5
+CACHE_EXPIRE = config.CACHE_EXPIRE
 
 
 class BaseService:
@@ -31,17 +38,25 @@ class BaseService:
     def __init__(self, cache: Cacheable, elastic: EsService):
         self.cache = cache
         self.elastic = elastic
+        self.flight = SingleFlight()
+        self.revalidator = get_revalidator()
 
     async def get_request(self,
                           sort_field: str = None,
                           filter_genre: str = None,
                           page_number: str = None,
                           page_size: int = None,
-                          q: str = None) -> list:
+                          q: str = None,
+                          shape: Type[BaseModel] = None) -> bytes or None:
+        """Return the response payload for a request as JSON bytes.
 
+        ``shape`` is the response model of the endpoint. Every endpoint and
+        shape has its own cache entry, so a hit is sent to the client as is.
+        """
+        shape = shape or self.model
         if q:
             query = None
-            key = f'{self.es_index}:{q}'
+            key = f'{self.es_index}:{shape.__name__}:search:{q}'
         else:
             query = await self._query_dict(
                 sort=sort_field,
@@ -49,45 +64,193 @@ class BaseService:
                 page_number=page_number,
                 page_size=page_size
             )
-            key = self.es_index + ':' + ':'.join([str(b) for _, b in query.items()])
+            key = f'{self.es_index}:{shape.__name__}:' + ':'.join([str(b) for _, b in query.items()])
 
-        film = await self._get_film_sorted_from_cache(key=key)
-        if not film:
-            film = await self._get_film_by_search_from_elastic(
+        return await self._get_cached(
+            key, lambda: self._get_film_by_search_from_elastic(
                 query=query,
                 q=q,
+                shape=shape,
+            ), shape=shape)
+
+    async def get_page(self,
+                       cursor: str,
+                       sort_field: str = None,
+                       filter_genre: str = None,
+                       page_size: int = None,
+                       shape: Type[BaseModel] = None) -> tuple:
+        """Return ``(payload, next_cursor)`` for cursor based pagination.
+
+        Pages are fetched with ``search_after`` on the endpoint sort plus
+        ``id`` as a tiebreak, so every page costs the same however deep it is.
+        They are not cached: a full scroll rarely repeats. A cursor issued
+        for another sort or filter, or whose point in time has expired,
+        raises ``InvalidCursor``.
+        """
+        shape = shape or self.model
+        query = await self._query_dict(
+            sort=sort_field,
+            filter_genre=filter_genre,
+            page_size=page_size,
+        )
+        sort = self._sort(query) + [{'id': 'asc'}]
+        # search_after values only make sense for the query that produced them
+        scope = [self.es_index, sort, query['filter_genre']]
+        search_after, pit = decode_cursor(cursor, scope)
+        if pit is None and config.ELASTIC_CURSOR_PIT:
+            pit = await self.elastic.open_pit(self.es_index)
+
+        try:
+            doc = await self.elastic.get_search(
+                es_index=self.es_index,
+                params=SearchParams(
+                    filter_genre=query['filter_genre'],
+                    sort=sort,
+                    page_size=page_size,
+                    source=self._source_fields(shape),
+                    search_after=search_after,
+                    pit=pit,
+                    keep_alive=config.ELASTIC_PIT_KEEP_ALIVE if pit else None,
+                ),
             )
-            if not film:
-                return None
-            await self.cache.set(key=key, value=json.dumps(film, default=pydantic_encoder), expire=CACHE_EXPIRE)
-        return film
+        except (NotFoundError, RequestError):
+            # An expired point in time or search_after values the index
+            # rejects: the cursor is no longer usable, not a server error
+            if search_after is None:
+                raise
+            raise InvalidCursor(cursor)
+        hits = doc['hits']['hits']
+        pit = doc.get('pit_id', pit)
+        if len(hits) < page_size:
+            if pit:
+                await self.elastic.close_pit(pit)
+            next_cursor = None
+        else:
+            next_cursor = encode_cursor(hits[-1]['sort'], pit, scope)
+        if not hits:
+            return None, None
+        film = [shape(**movie['_source']) for movie in hits]
+        return self._dump(film, shape=shape), next_cursor
+
+    async def get_by_id(self,
+                        doc_id: str,
+                        shape: Type[BaseModel] = None) -> bytes or None:
+        """Return the payload of a single document looked up by ``_id``."""
+        shape = shape or self.model
+
+        async def loader():
+            doc = await self.elastic.get_by_id(
+                es_index=self.es_index,
+                doc_id=doc_id,
+                source=self._source_fields(shape),
+            )
+            return [shape(**doc)] if doc else None
 
-    async def _get_film_sorted_from_cache(self, key: str) -> str or list:
+        return await self._get_cached(
+            f'{self.es_index}:{shape.__name__}:id:{doc_id}',
+            loader, shape=shape, many=False)
+
+    async def get_many(self,
+                       doc_ids: list,
+                       shape: Type[BaseModel] = None) -> list:
+        """Resolve many documents by ``_id`` in one round-trip.
+
+        Missing ids are skipped, the order of ``doc_ids`` is kept.
+        """
+        shape = shape or self.model
+        if not doc_ids:
+            return []
+        docs = await self.elastic.get_many(
+            es_index=self.es_index,
+            doc_ids=doc_ids,
+            source=self._source_fields(shape),
+        )
+        return [shape(**doc) for doc in docs]
+
+    def _source_fields(self, shape: Type[BaseModel]) -> list or None:
+        return None if shape is self.model else list(shape.__fields__)
+
+    async def _get_cached(self,
+                          key: str,
+                          loader: Callable[[], Awaitable],
+                          shape: Type[BaseModel],
+                          many: bool = True) -> bytes or None:
+        """Serve ``key`` from cache, falling back to ``loader`` on a miss.
+
+        Stale entries are returned as is while a background task reloads them.
+        """
         data = await self.cache.get(key)
-        if not data:
+        if data:
+            data, stale = unpack(data)
+            if stale:
+                self.revalidator.schedule(
+                    key, lambda: self._load_to_cache(key, loader, shape, many))
+            return data
+        return await self.flight.do(
+            key, lambda: self._load_to_cache(key, loader, shape, many))
+
+    async def _load_to_cache(self,
+                             key: str,
+                             loader: Callable[[], Awaitable],
+                             shape: Type[BaseModel],
+                             many: bool = True) -> bytes or None:
+        film = await loader()
+        if not film:
             return None
-        try:
-            return parse_raw_as(list[self.model], data)
-        except:
-            return self.model.parse_raw(data)
+        value = self._dump(film, shape=shape, many=many)
+        if config.CACHE_STALE_WHILE_REVALIDATE:
+            await self.cache.set(key=key,
+                                 value=pack(value, CACHE_EXPIRE),
+                                 expire=config.CACHE_STALE_EXPIRE)
+        else:
+            await self.cache.set(key=key, value=value, expire=CACHE_EXPIRE)
+        return value
+
+    @staticmethod
+    def _dump(film: list, shape: Type[BaseModel], many: bool = True) -> bytes:
+        fields = shape.__fields__.keys()
+        # exclude_unset: fields missing from the document are omitted, not
+        # sent as null, as with response_model_exclude_unset on the routes
+        if type(film[0]) is not shape:
+            film = [shape(**item.dict(include=fields, exclude_unset=True)) for item in film]
+        if many:
+            return orjson.dumps([item.dict(exclude_unset=True) for item in film])
+        return orjson.dumps(film[0].dict(exclude_unset=True))
 
     async def _get_film_by_search_from_elastic(
             self,
             query: dict = None,
-            q: str = None,) -> list:
+            q: str = None,
+            shape: Type[BaseModel] = None) -> list:
+        """Search the index and parse hits into ``shape``.
 
-        doc = await self.elastic.get_search(
-            es_index=self.es_index,
-            func_name='body_search' if q else None,
-            field=self.es_field,
+        Only the fields of ``shape`` are fetched from ``_source``, so short
+        list views neither transfer nor validate full documents.
+        """
+        shape = shape or self.model
+        params = SearchParams(
             q=q,
-            query=query,
+            fields=self.es_field if q else None,
+            source=self._source_fields(shape),
         )
+        if query:
+            params.filter_genre = query['filter_genre']
+            params.sort = self._sort(query) or None
+            params.page_number = query['page_number']
+            params.page_size = query['page_size']
+        doc = await self.elastic.get_search(es_index=self.es_index,
+                                            params=params)
         result = []
         for movie in doc['hits']['hits']:
-            result.append(self.model(**movie['_source']))
+            result.append(shape(**movie['_source']))
         return result
 
+    @staticmethod
+    def _sort(query: dict) -> list:
+        if not query['sort_field']:
+            return []
+        return [{query['sort_field']: query['sort_type']}]
+
     async def _query_dict(self,
                          sort: str = None,
                          filter_genre: str = None,
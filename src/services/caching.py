@@ -1,7 +1,12 @@
-from typing import Union
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Union
+
 import backoff
 from aioredis import Redis
 
+from core import config
 from services.interfaces import Cacheable
 
 
@@ -14,5 +19,99 @@ class RedisService(Cacheable):
         return await self.redis.get(key)
 
     @backoff.on_exception(backoff.expo, BaseException, max_time=10, factor=2)
-    async def set(self, key: str, value: str, expire: int) -> None:
+    async def set(self, key: str, value: Union[str, bytes],
+                  expire: int) -> None:
         await self.redis.set(key=key, value=value, expire=expire)
+
+
+class LocalCache:
+    """Bounded in-process LRU with per-entry TTL and a byte-size cap."""
+
+    def __init__(self, max_items: int, max_bytes: int, ttl: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Union[str, bytes], expire: int) -> None:
+        if isinstance(value, str):
+            value = value.encode()
+        self._pop(key)
+        ttl = min(expire, self.ttl)
+        if ttl <= 0 or len(value) > self.max_bytes:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self.size += len(value)
+        while len(self._data) > self.max_items or self.size > self.max_bytes:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _pop(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= len(item[1])
+
+
+class TwoTierCache(Cacheable):
+    """Serves hot keys from process memory and falls back to Redis."""
+
+    def __init__(self, remote: Cacheable, local: LocalCache):
+        self.remote = remote
+        self.local = local
+        self.remote_hits = 0
+        self.remote_misses = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value = await self.remote.get(key)
+        if value is None:
+            self.remote_misses += 1
+            return None
+        self.remote_hits += 1
+        self.local.set(key, value, self.local.ttl)
+        return value
+
+    async def set(self, key: str, value: Union[str, bytes],
+                  expire: int) -> None:
+        await self.remote.set(key=key, value=value, expire=expire)
+        self.local.set(key, value, expire)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'local_hits': self.local.hits,
+            'local_misses': self.local.misses,
+            'local_items': len(self.local),
+            'local_bytes': self.local.size,
+            'remote_hits': self.remote_hits,
+            'remote_misses': self.remote_misses,
+        }
+
+
+@lru_cache()
+def get_local_cache() -> LocalCache:
+    return LocalCache(max_items=config.LOCAL_CACHE_MAX_ITEMS,
+                      max_bytes=config.LOCAL_CACHE_MAX_BYTES,
+                      ttl=config.LOCAL_CACHE_TTL)
@@ -0,0 +1,40 @@
+import base64
+import binascii
+
+import orjson
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(search_after: list, pit: str = None,
+                  scope: list = None) -> str:
+    """Pack ``search_after`` sort values into an opaque URL-safe token.
+
+    ``scope`` names the query the cursor was issued for (index, sort and
+    filter); ``decode_cursor`` rejects the token for any other query.
+    """
+    data = {'after': search_after}
+    if pit:
+        data['pit'] = pit
+    if scope is not None:
+        data['scope'] = scope
+    return base64.urlsafe_b64encode(orjson.dumps(data)).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str,
+                  scope: list = None) -> tuple[list or None, str or None]:
+    """Return ``(search_after, pit)``; an empty cursor starts from the top."""
+    if not cursor:
+        return None, None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = orjson.loads(base64.urlsafe_b64decode(cursor + padding))
+        search_after = data['after']
+    except (binascii.Error, orjson.JSONDecodeError, KeyError, TypeError,
+            ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(search_after, list) or data.get('scope') != scope:
+        raise InvalidCursor(cursor)
+    return search_after, data.get('pit')
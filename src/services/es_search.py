@@ -1,46 +1,101 @@
-from elasticsearch import AsyncElasticsearch, ConnectionError
+from elasticsearch import AsyncElasticsearch, ConnectionError, NotFoundError
 import backoff
 
+from core import config
 from services.interfaces import EsSearch
+from services.query_builder import QueryBuilder, SearchParams, get_query_builder
 
 
 class EsService(EsSearch):
 
-    def __init__(self, elastic: AsyncElasticsearch):
+    def __init__(self, elastic: AsyncElasticsearch,
+                 builder: QueryBuilder = None):
         self.elastic = elastic
+        self.builder = builder or get_query_builder()
 
-    async def body_search(self, q: str, field: list):
-        return {'query': {
-            'multi_match': {
-                'query': f'{q}',
-                'fields': field
-            }
-        }}
+    @backoff.on_exception(backoff.expo, ConnectionError, max_time=10, factor=2)
+    async def get_search(self, es_index: str, params: SearchParams) -> dict:
+        """Run the search described by ``params``.
+
+        A search with ``params.pit`` runs against the point in time instead
+        of the live index, so cursor pages stay consistent under updates.
+        """
+        return await self.elastic.search(
+            index=None if params.pit else es_index,
+            body=self.builder.search(params),
+        )
 
-    async def body_all(self):
-        return {'query': {'match_all': {}}}
+    async def open_pit(self, es_index: str) -> str:
+        doc = await self.elastic.open_point_in_time(
+            index=es_index, keep_alive=config.ELASTIC_PIT_KEEP_ALIVE)
+        return doc['id']
+
+    async def close_pit(self, pit: str) -> None:
+        await self.elastic.close_point_in_time(body={'id': pit}, ignore=404)
 
     @backoff.on_exception(backoff.expo, ConnectionError, max_time=10, factor=2)
-    async def get_search(
+    async def get_by_id(
             self,
             es_index: str,
-            func_name: str,
-            field: list,
-            q: str = None,
-            query: dict = None
+            doc_id: str,
+            source: list = None,
+    ) -> dict or None:
+        try:
+            doc = await self.elastic.get(index=es_index, id=doc_id,
+                                         _source_includes=source)
+        except NotFoundError:
+            return None
+        return doc['_source']
+
+    @backoff.on_exception(backoff.expo, ConnectionError, max_time=10, factor=2)
+    async def get_many(
+            self,
+            es_index: str,
+            doc_ids: list,
+            source: list = None,
     ) -> list:
+        doc = await self.elastic.mget(index=es_index, body={'ids': doc_ids},
+                                      _source_includes=source)
+        return [item['_source'] for item in doc['docs'] if item.get('found')]
 
-        if q:
-            body = await self.body_search(field=field, q=q)
-        else:
-            body = await self.body_all()
-
-        doc = self.elastic.search(
-            index=es_index,
-            body=body,
-            size=query.get('page_size') if query else None,
-            from_=query.get('page_number') * query.get(
-                'page_size') if query else None,
-            sort=f'{query.get("sort_field")}:{query.get("sort_type")}' if query else None,
+    @backoff.on_exception(backoff.expo, ConnectionError, max_time=10, factor=2)
+    async def get_alike(
+            self,
+            es_index: str,
+            film_id: str,
+            genre_ids: list,
+            size: int,
+            source: list = None,
+    ) -> dict:
+        """Films sharing genres with ``film_id``, most shared genres first."""
+        body = self.builder.render(
+            'alike',
+            film_id=film_id,
+            genre_ids=genre_ids,
+            size=size,
+            source=True if source is None else source,
         )
-        return await doc
+        return await self.elastic.search(index=es_index, body=body)
+
+    @backoff.on_exception(backoff.expo, ConnectionError, max_time=10, factor=2)
+    async def get_vector_search(
+            self,
+            es_index: str,
+            vector: list,
+            q: str = None,
+            fields: list = None,
+            weight: float = None,
+            source: list = None,
+    ) -> dict:
+        """Films ranked by embedding similarity to ``vector``.
+
+        With ``q`` the similarity is added to the text score of ``q``.
+        """
+        source = True if source is None else source
+        if q is None:
+            body = self.builder.render('vector', vector=vector, source=source)
+        else:
+            body = self.builder.render('hybrid', vector=vector, q=q,
+                                       fields=fields, weight=weight,
+                                       source=source)
+        return await self.elastic.search(index=es_index, body=body)
@@ -1,58 +1,139 @@
-import json
+import math
+import re
+from enum import Enum
 from functools import lru_cache
+from typing import Type
 
 from fastapi import Depends
-from pydantic.json import pydantic_encoder
+from pydantic import BaseModel
 
+from core import config
 from db.elastic import get_elastic
 from db.redis import get_redis
-from models.models import Film
+from models.models import Film, FilmShort
 from services.base import BaseService
-from services.caching import RedisService
+from services.caching import RedisService, TwoTierCache, get_local_cache
 from services.es_search import EsService
 from services.interfaces import Cacheable, EsSearch
 
-CACHE_EXPIRE = 60 * 5
+# Words as the ETL splits titles and descriptions into its vocabulary
+# (postgres_to_es/embedding.py); both sides must agree.
+TOKEN = re.compile(r'\w+')
+
+
+class SearchMode(str, Enum):
+    text = 'text'
+    vector = 'vector'
+    hybrid = 'hybrid'
 
 
 class FilmService(BaseService):
     es_index = 'movies'
     model = Film
     es_field = ['id', 'title', 'genre.id']
+    alike_size = 10
+
+    async def search(self,
+                     q: str,
+                     mode: SearchMode = SearchMode.text,
+                     shape: Type[BaseModel] = None) -> bytes or None:
+        """Search films by text, by embedding similarity or by both.
+
+        Film vectors are computed by the ETL. The query vector is the sum of
+        the query words' vectors from the ETL vocabulary, one ``mget``.
+        """
+        if mode is SearchMode.text:
+            return await self.get_request(q=q, shape=shape)
+        shape = shape or self.model
+        # Not search:{mode}:{q}: that is also the text key of the query '{mode}:{q}'
+        return await self._get_cached(
+            f'{self.es_index}:{shape.__name__}:search_{mode.value}:{q}',
+            lambda: self._get_film_by_vector_from_elastic(q, mode, shape),
+            shape=shape)
+
+    async def _get_film_by_vector_from_elastic(
+            self,
+            q: str,
+            mode: SearchMode,
+            shape: Type[BaseModel]) -> list or None:
+        vector = await self._query_vector(q)
+        if vector is None:
+            # No query word is known to the model: hybrid degrades to text
+            if mode is SearchMode.hybrid:
+                return await self._get_film_by_search_from_elastic(q=q, shape=shape)
+            return None
+        hybrid = mode is SearchMode.hybrid
+        doc = await self.elastic.get_vector_search(
+            es_index=self.es_index,
+            vector=vector,
+            q=q if hybrid else None,
+            fields=self.es_field if hybrid else None,
+            weight=config.HYBRID_VECTOR_WEIGHT if hybrid else None,
+            source=self._source_fields(shape),
+        )
+        return [shape(**movie['_source']) for movie in doc['hits']['hits']]
+
+    async def _query_vector(self, q: str) -> list or None:
+        words = sorted(set(TOKEN.findall(q.lower())))
+        if not words:
+            return None
+        terms = await self.elastic.get_many(
+            es_index=config.ELASTIC_TERMS_INDEX,
+            doc_ids=words,
+            source=['vector'],
+        )
+        if not terms:
+            return None
+        vector = [sum(values) for values in zip(*(term['vector'] for term in terms))]
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else None
+
+    async def get_film_alike(self, film_id: str) -> bytes or None:
+        return await self._get_cached(
+            f'alike:{film_id}',
+            lambda: self._get_film_alike_from_elastic(film_id),
+            shape=FilmShort)
+
+    async def _get_film_alike_from_elastic(
+            self, film_id: str) -> list[FilmShort] or None:
+        """One document fetch: the list is precomputed by the ETL.
+
+        Films the ETL has not ranked yet fall back to shared genres.
+        """
+        doc = await self.elastic.get_by_id(
+            es_index=config.ELASTIC_ALIKE_INDEX,
+            doc_id=film_id,
+            source=['films'],
+        )
+        if doc and doc.get('films'):
+            return [FilmShort(**film) for film in doc['films']]
+        return await self._get_film_alike_by_genre(film_id)
 
-    async def get_film_alike(self, film_id: str) -> list[Film] or None:
-        film_list = await self._get_film_sorted_from_cache("alike:"+film_id)
-        if not film_list:
-            get_films = await self._get_film_by_search_from_elastic(
-                query=None,
-                q=film_id,
-            )
-            film = get_films[0]
-            film_list = []
-            query = {
-                'sort_field': 'imdb_rating',
-                'sort_type': 'desc',
-                'page_number': 0,
-                'page_size': 10
-            }
-            for genre in film.genre:
-                alike_films = await self._get_film_by_search_from_elastic(
-                    query,
-                    q=genre['id']
-                )
-                print(genre)
-                if alike_films:
-                    film_list.extend(alike_films)
-            await self.cache.set(
-                key=f'alike:{film_id}',
-                value=json.dumps(list(film_list),
-                default=pydantic_encoder), expire=CACHE_EXPIRE)
-
-        return film_list
+    async def _get_film_alike_by_genre(
+            self, film_id: str) -> list[FilmShort] or None:
+        """Two round-trips: the film's genres, then one ranked bool query."""
+        film = await self.elastic.get_by_id(
+            es_index=self.es_index,
+            doc_id=film_id,
+            source=['genre'],
+        )
+        if not film or not film.get('genre'):
+            return None
+        doc = await self.elastic.get_alike(
+            es_index=self.es_index,
+            film_id=film_id,
+            genre_ids=[genre['id'] for genre in film['genre']],
+            size=self.alike_size,
+            source=list(FilmShort.__fields__),
+        )
+        return [FilmShort(**movie['_source'])
+                for movie in doc['hits']['hits']]
 
 
 @lru_cache()
 def get_film_service(
         redis: Cacheable = Depends(get_redis),
         elastic: EsSearch = Depends(get_elastic)) -> FilmService:
-    return FilmService(RedisService(redis), EsService(elastic))
+    return FilmService(
+        TwoTierCache(RedisService(redis), get_local_cache()),
+        EsService(elastic))
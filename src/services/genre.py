@@ -6,7 +6,7 @@ from db.elastic import get_elastic
 from db.redis import get_redis
 from models.models import Genre
 from services.base import BaseService
-from services.caching import RedisService
+from services.caching import RedisService, TwoTierCache, get_local_cache
 from services.es_search import EsService
 from services.interfaces import Cacheable, EsSearch
 
@@ -22,4 +22,6 @@ def get_genre_service(
         redis: Cacheable = Depends(get_redis),
         elastic: EsSearch = Depends(get_elastic),
 ) -> GenreService:
-    return GenreService(RedisService(redis), EsService(elastic))
+    return GenreService(
+        TwoTierCache(RedisService(redis), get_local_cache()),
+        EsService(elastic))
@@ -14,18 +14,40 @@ class Cacheable(ABC):
 class EsSearch(ABC):
 
     @abstractmethod
-    def body_search(self, key: str, query: str):
+    def get_search(self, es_index: str, params):
         pass
 
     @abstractmethod
-    def body_all(self):
+    def open_pit(self, es_index: str):
         pass
 
     @abstractmethod
-    def get_search(self,
-                   es_index: str,
-                   func_name: str,
-                   field: list,
-                   q: str = None,
-                   query: dict = None):
+    def close_pit(self, pit: str):
+        pass
+
+    @abstractmethod
+    def get_by_id(self, es_index: str, doc_id: str, source: list = None):
+        pass
+
+    @abstractmethod
+    def get_many(self, es_index: str, doc_ids: list, source: list = None):
+        pass
+
+    @abstractmethod
+    def get_alike(self,
+                  es_index: str,
+                  film_id: str,
+                  genre_ids: list,
+                  size: int,
+                  source: list = None):
+        pass
+
+    @abstractmethod
+    def get_vector_search(self,
+                          es_index: str,
+                          vector: list,
+                          q: str = None,
+                          fields: list = None,
+                          weight: float = None,
+                          source: list = None):
         pass
@@ -4,9 +4,9 @@ from fastapi import Depends
 
 from db.elastic import get_elastic
 from db.redis import get_redis
-from models.models import Person
+from models.models import Person, PersonFilm
 from services.base import BaseService
-from services.caching import RedisService
+from services.caching import RedisService, TwoTierCache, get_local_cache
 from services.es_search import EsService
 from services.interfaces import Cacheable, EsSearch
 
@@ -16,10 +16,30 @@ class PersonService(BaseService):
     model = Person
     es_field = ['id', 'full_name']
 
+    async def get_person_films(self, person_id: str) -> bytes or None:
+        return await self._get_cached(
+            f'person_films:{person_id}',
+            lambda: self._get_person_films_from_elastic(person_id),
+            shape=PersonFilm)
+
+    async def _get_person_films_from_elastic(
+            self, person_id: str) -> list[PersonFilm] or None:
+        """One document fetch: film summaries are embedded by the ETL."""
+        person = await self.elastic.get_by_id(
+            es_index=self.es_index,
+            doc_id=person_id,
+            source=['films'],
+        )
+        if not person or not person.get('films'):
+            return None
+        return [PersonFilm(**film) for film in person['films']]
+
 
 @lru_cache()
 def get_person_service(
         redis: Cacheable = Depends(get_redis),
         elastic: EsSearch = Depends(get_elastic),
 ) -> PersonService:
-    return PersonService(RedisService(redis), EsService(elastic))
+    return PersonService(
+        TwoTierCache(RedisService(redis), get_local_cache()),
+        EsService(elastic))
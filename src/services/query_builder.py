@@ -0,0 +1,183 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+import orjson
+
+PLACEHOLDER = re.compile(rb'"\{\{(\w+)\}\}"')
+
+VECTOR_SIMILARITY = ("doc['embedding'].size() == 0 ? 0 : "
+                     "dotProduct(params.vector, 'embedding') + 1.0")
+
+
+def param(name: str) -> str:
+    """Placeholder for a value substituted at render time."""
+    return '{{%s}}' % name
+
+
+class QueryTemplate:
+    """A request body serialized to JSON once.
+
+    Rendering only serializes the parameter values and splices them between
+    the static chunks, no nested dicts are rebuilt per request.
+    """
+
+    def __init__(self, body: dict):
+        parts = PLACEHOLDER.split(orjson.dumps(body))
+        self.chunks = parts[0::2]
+        self.params = [name.decode() for name in parts[1::2]]
+
+    def render(self, **values) -> str:
+        body = [self.chunks[0]]
+        for name, chunk in zip(self.params, self.chunks[1:]):
+            body.append(orjson.dumps(values[name]))
+            body.append(chunk)
+        return b''.join(body).decode()
+
+
+@dataclass
+class SearchParams:
+    q: Optional[str] = None
+    fields: Optional[list] = None
+    filter_genre: Optional[str] = None
+    sort: Optional[list] = None
+    page_number: Optional[int] = None
+    page_size: Optional[int] = None
+    source: Optional[list] = None
+    search_after: Optional[list] = None
+    pit: Optional[str] = None
+    keep_alive: Optional[str] = None
+
+
+class QueryBuilder:
+    """Turns typed search parameters into Elasticsearch request bodies.
+
+    Templates are either registered by name or compiled on first use for
+    each combination of parameters a search actually sets.
+    """
+
+    def __init__(self):
+        self._templates: dict = {}
+
+    def register(self, name: str, body: dict) -> None:
+        self._templates[name] = QueryTemplate(body)
+
+    def render(self, name: str, **values) -> str:
+        return self._templates[name].render(**values)
+
+    def search(self, params: SearchParams) -> str:
+        features = (
+            'search' if params.q is not None else
+            'genre' if params.filter_genre else 'all',
+            params.sort is not None,
+            params.page_size is not None,
+            params.page_number is not None and params.page_size is not None,
+            params.source is not None,
+            params.search_after is not None,
+            params.pit is not None,
+        )
+        template = self._templates.get(features)
+        if template is None:
+            template = self._templates[features] = QueryTemplate(
+                self._skeleton(*features))
+        return template.render(
+            q=params.q,
+            fields=params.fields,
+            genre=params.filter_genre,
+            sort=params.sort,
+            size=params.page_size,
+            offset=(params.page_number or 0) * (params.page_size or 0),
+            source=params.source,
+            after=params.search_after,
+            pit=params.pit,
+            keep_alive=params.keep_alive,
+        )
+
+    @staticmethod
+    def _skeleton(query: str, sort: bool, size: bool, offset: bool,
+                  source: bool, after: bool, pit: bool) -> dict:
+        if query == 'search':
+            body = {'query': {'multi_match': {
+                'query': param('q'),
+                'fields': param('fields'),
+            }}}
+        elif query == 'genre':
+            body = {'query': {'bool': {'filter': [
+                {'nested': {
+                    'path': 'genre',
+                    'query': {'term': {'genre.id': param('genre')}},
+                }}
+            ]}}}
+        else:
+            body = {'query': {'match_all': {}}}
+        if sort:
+            body['sort'] = param('sort')
+        if size:
+            body['size'] = param('size')
+        if offset:
+            body['from'] = param('offset')
+        if source:
+            body['_source'] = param('source')
+        if after:
+            body['search_after'] = param('after')
+        if pit:
+            body['pit'] = {'id': param('pit'), 'keep_alive': param('keep_alive')}
+        return body
+
+
+def register_templates(builder: QueryBuilder) -> QueryBuilder:
+    # Films sharing genres with a film: the nested constant_score clause
+    # scores one per shared genre, summed over the film's genres.
+    builder.register('alike', {
+        'query': {'bool': {
+            'must': [{'nested': {
+                'path': 'genre',
+                'score_mode': 'sum',
+                'query': {'constant_score': {
+                    'filter': {'terms': {'genre.id': param('genre_ids')}},
+                }},
+            }}],
+            'must_not': [{'ids': {'values': [param('film_id')]}}],
+        }},
+        'sort': ['_score', {'imdb_rating': 'desc'}],
+        'size': param('size'),
+        '_source': param('source'),
+    })
+    # Films by cosine of their embedding to the query vector, shifted to
+    # stay non-negative. Both are unit length, so the dot product is the
+    # cosine. A film indexed without a vector scores zero.
+    builder.register('vector', {
+        'query': {'script_score': {
+            'query': {'match_all': {}},
+            'script': {
+                'source': VECTOR_SIMILARITY,
+                'params': {'vector': param('vector')},
+            },
+        }},
+        '_source': param('source'),
+    })
+    # The text score plus the weighted vector similarity; films without
+    # a text match can still rank by the vector alone.
+    builder.register('hybrid', {
+        'query': {'script_score': {
+            'query': {'bool': {
+                'must': [{'match_all': {}}],
+                'should': [{'multi_match': {
+                    'query': param('q'),
+                    'fields': param('fields'),
+                }}],
+            }},
+            'script': {
+                'source': f'_score + params.weight * ({VECTOR_SIMILARITY})',
+                'params': {'vector': param('vector'), 'weight': param('weight')},
+            },
+        }},
+        '_source': param('source'),
+    })
+    return builder
+
+
+@lru_cache()
+def get_query_builder() -> QueryBuilder:
+    return register_templates(QueryBuilder())
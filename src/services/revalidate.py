@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+from functools import lru_cache
+from typing import Awaitable, Callable, Union
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = b'|'
+
+
+def pack(value: bytes, soft_expire: int) -> bytes:
+    """Prefix a cached value with the moment it becomes stale."""
+    return b'%d|' % (time.time() + soft_expire) + value
+
+
+def unpack(data: Union[str, bytes]) -> tuple[bytes, bool]:
+    """Split a cached value into its payload and a staleness flag.
+
+    Values written without the soft deadline prefix are never stale.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    if data[:1] in (b'[', b'{'):
+        return data, False
+    deadline, _, payload = data.partition(SEPARATOR)
+    return payload, float(deadline) <= time.time()
+
+
+class Revalidator:
+    """Refreshes stale cache entries in background tasks.
+
+    At most one refresh runs per key and no more than ``limit`` at once;
+    anything over the limit keeps being served stale until the next hit.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.started = 0
+        self.skipped = 0
+        self.failed = 0
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def schedule(self, key: str, func: Callable[[], Awaitable]) -> None:
+        if key in self._tasks:
+            return
+        if len(self._tasks) >= self.limit:
+            self.skipped += 1
+            return
+        self.started += 1
+        task = asyncio.ensure_future(func())
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        self._tasks.pop(key, None)
+        if not task.cancelled() and task.exception():
+            self.failed += 1
+            logger.warning('Cache refresh for %s failed: %r',
+                           key, task.exception())
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'started': self.started,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'in_flight': len(self._tasks),
+        }
+
+
+@lru_cache()
+def get_revalidator() -> Revalidator:
+    return Revalidator(limit=config.CACHE_REFRESH_CONCURRENCY)
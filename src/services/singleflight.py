@@ -0,0 +1,31 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one in-flight call."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable]) -> Any:
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            flight = asyncio.ensure_future(func())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        # A cancelled caller must not cancel the query other waiters share.
+        return await asyncio.shield(flight)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._flights),
+        }
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from alike import AlikeIndex
+
+
+def catalogue(size: int, seed: int = 0) -> list:
+    rand = random.Random(seed)
+    return [{
+        'id': f'film-{i:03}',
+        'title': f'Film {i}',
+        'rating': rand.choice([None, round(rand.uniform(1, 10), 1)]),
+        'genre_ids': rand.sample(range(8), rand.randint(0, 3)),
+        'person_ids': rand.sample(range(size), rand.randint(0, 6)),
+    } for i in range(size)]
+
+
+def brute_force(rows: list, k: int) -> dict:
+    """Списки похожих тем же скорингом, но без numpy, по одной паре фильмов"""
+    def similarity(a: dict, b: dict) -> float:
+        score = 0
+        for key in ('genre_ids', 'person_ids'):
+            left, right = set(a[key] or ()), set(b[key] or ())
+            score += len(left & right) / (max(len(left), 1) * max(len(right), 1)) ** 0.5
+        if a['rating'] is not None and b['rating'] is not None:
+            score += 0.2 * (1 - abs(a['rating'] - b['rating']) / 10)
+        return score
+
+    result = {}
+    for film in rows:
+        others = sorted((-similarity(film, other), other['id'])
+                        for other in rows if other['id'] != film['id'])
+        result[film['id']] = [score for score, _ in others[:k]]
+    return result
+
+
+def test_alike_matches_brute_force():
+    rows = catalogue(120)
+    alike = AlikeIndex(k=5, block_size=16)
+    docs, removed = alike.update(rows)
+
+    assert len(docs) == len(rows) and removed == set()
+    expected = brute_force(rows, 5)
+    for film_id, scores in alike.scores.items():
+        assert np.allclose(-np.array(expected[film_id]), scores, atol=1e-5)
+    assert all(doc['id'] not in {f['id'] for f in doc['films']} for doc in docs)
+
+
+def test_incremental_update_matches_full_recompute():
+    rand = random.Random(1)
+    rows = catalogue(120)
+    alike = AlikeIndex(k=5, block_size=16)
+    alike.update(rows)
+
+    for step in range(3):
+        rows = [dict(row) for row in rows]
+        for row in rand.sample(rows, 4):
+            row['rating'] = round(rand.uniform(1, 10), 1)
+            row['person_ids'] = rand.sample(range(120), rand.randint(0, 6))
+        gone = rows.pop(rand.randrange(len(rows)))
+        rows.append({**rand.choice(rows), 'id': f'new-{step}'})
+
+        docs, removed = alike.update(rows)
+        full = AlikeIndex(k=5, block_size=16)
+        full.update(rows)
+
+        assert removed == {gone['id']}
+        assert alike.docs == full.docs
+        assert len(docs) < len(rows)
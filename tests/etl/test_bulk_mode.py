@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip('elasticsearch')
+
+from elasticsearch import ConnectionError as EsConnectionError
+
+import es
+from es import BULK_SETTINGS, EsSaver
+from state import JsonFileStorage, State
+
+ORIGINAL = {'index.refresh_interval': '1s', 'index.number_of_replicas': '1'}
+
+
+class Indices:
+    """Настройки индекса; put_settings падает, пока не кончится fail_after"""
+
+    def __init__(self, fail_after: int):
+        self.settings = dict(ORIGINAL)
+        self.fail_after = fail_after
+
+    def get_settings(self, index, **kwargs):
+        return {index: {'settings': dict(self.settings)}}
+
+    def put_settings(self, body, index):
+        if self.fail_after == 0:
+            raise EsConnectionError('N/A', 'кластер недоступен', None)
+        self.fail_after -= 1
+        self.settings.update(body)
+
+    def refresh(self, index):
+        pass
+
+
+class Client:
+    def __init__(self, fail_after: int):
+        self.indices = Indices(fail_after)
+
+
+@pytest.fixture
+def saver(monkeypatch):
+    monkeypatch.setattr(es.time, 'sleep', lambda seconds: None)
+    return EsSaver(['localhost:9200'], max_retries=2)
+
+
+def test_failed_restore_keeps_original_settings(saver):
+    # Первый put_settings включает bulk-режим, восстановление не проходит
+    saver.client = Client(fail_after=1)
+    state = State(JsonFileStorage())
+
+    with pytest.raises(EsConnectionError):
+        with saver.bulk_mode('movies_v1', state):
+            pass
+
+    assert saver.client.indices.settings == {**ORIGINAL, **BULK_SETTINGS}
+    assert state.get_state('bulk_mode_movies_v1') == ORIGINAL
+
+
+def test_next_run_restores_saved_settings(saver):
+    saver.client = Client(fail_after=1)
+    state = State(JsonFileStorage())
+    with pytest.raises(EsConnectionError):
+        with saver.bulk_mode('movies_v1', state):
+            pass
+
+    saver.client.indices.fail_after = 2
+    with saver.bulk_mode('movies_v1', state):
+        pass
+
+    assert saver.client.indices.settings == ORIGINAL
+    assert state.get_state('bulk_mode_movies_v1') is None
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+from psycopg2.extras import DictCursor
+
+from change_feed import ChangeFeed
+from config import dsl
+
+FEED_SQL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'postgres_to_es', 'sql', 'etl_change_feed.sql')
+
+
+@pytest.fixture
+def pg_conn():
+    """Соединение с базой из dump.sql; триггеры и изменения откатываются"""
+    try:
+        conn = psycopg2.connect(**dsl, cursor_factory=DictCursor)
+    except psycopg2.OperationalError:
+        pytest.skip('Postgres с данными из dump.sql недоступен')
+    with conn.cursor() as cursor, open(FEED_SQL) as f:
+        cursor.execute(f.read())
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def query(conn, sql, **params) -> list:
+    with conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def test_person_change_reaches_films(pg_conn):
+    (person_id,), = query(pg_conn, 'SELECT person_id FROM content.person_film_work LIMIT 1')
+    query(pg_conn, 'UPDATE content.person SET updated_at = now() '
+                   'WHERE id = %(id)s RETURNING id', id=person_id)
+    films = query(pg_conn, 'SELECT film_work_id FROM content.person_film_work '
+                           'WHERE person_id = %(id)s', id=person_id)
+
+    log_ids, changed = ChangeFeed(pg_conn, saver=None).collect()
+
+    assert len(log_ids) == 1
+    assert changed['person'] == {person_id}
+    assert changed['movies'] == {film_id for film_id, in films}
+    assert changed['genre'] == set()
+
+
+def test_film_change_reaches_persons(pg_conn):
+    (film_id,), = query(pg_conn, 'SELECT film_work_id FROM content.person_film_work LIMIT 1')
+    query(pg_conn, 'UPDATE content.film_work SET rating = rating '
+                   'WHERE id = %(id)s RETURNING id', id=film_id)
+    persons = query(pg_conn, 'SELECT person_id FROM content.person_film_work '
+                             'WHERE film_work_id = %(id)s', id=film_id)
+
+    log_ids, changed = ChangeFeed(pg_conn, saver=None).collect()
+
+    assert len(log_ids) == 1
+    assert changed['movies'] == {film_id}
+    assert changed['person'] == {person_id for person_id, in persons}
+
+
+def test_deleted_link_marks_film(pg_conn):
+    (film_id, genre_id), = query(
+        pg_conn, 'DELETE FROM content.genre_film_work WHERE id = '
+                 '(SELECT id FROM content.genre_film_work LIMIT 1) '
+                 'RETURNING film_work_id, genre_id')
+
+    log_ids, changed = ChangeFeed(pg_conn, saver=None).collect()
+
+    assert len(log_ids) == 1
+    assert changed['movies'] == {film_id}
+    assert changed['genre'] == set()
+
@@ -0,0 +1,62 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from embedding import Sparse, TextEmbedder, tokenize
+
+FILMS = [
+    {'title': 'Star Wars', 'description': 'Jedi knights fight the empire in space'},
+    {'title': 'Star Trek', 'description': 'A starship explores deep space'},
+    {'title': 'The Dog', 'description': 'A dog finds its way home'},
+    {'title': 'Dog Days', 'description': 'Summer with a lazy dog'},
+    {'title': 'Silent Night', 'description': None},
+    {'title': '', 'description': ''},
+]
+
+
+def test_sparse_dot_matches_dense():
+    rand = np.random.default_rng(0)
+    rows, cols = rand.integers(0, 50, 300), rand.integers(0, 40, 300)
+    pairs = np.unique(rows * 40 + cols)
+    data = rand.random(len(pairs))
+    matrix = Sparse(pairs // 40, pairs % 40, data, (60, 40))
+    dense = np.zeros((60, 40), dtype=np.float32)
+    dense[pairs // 40, pairs % 40] = data
+    right, left = rand.random((40, 5)).astype(np.float32), rand.random((60, 3)).astype(np.float32)
+
+    assert np.allclose(matrix.dot(right), dense @ right, atol=1e-5)
+    assert np.allclose(matrix.T.dot(left), dense.T @ left, atol=1e-5)
+
+
+def test_encode_is_batched_and_normalized():
+    embedder = TextEmbedder.fit(FILMS, buckets=256, dims=4)
+    vectors = embedder.encode(FILMS)
+
+    assert vectors.shape == (len(FILMS), 4)
+    assert np.allclose(np.vstack([embedder.encode([film]) for film in FILMS]), vectors, atol=1e-6)
+    assert np.allclose(np.linalg.norm(vectors[:5], axis=1), 1, atol=1e-5)
+    # Фильм без слов остаётся нулевым вектором
+    assert not vectors[5].any()
+
+
+def test_query_from_terms_finds_film():
+    embedder = TextEmbedder.fit(FILMS, buckets=256, dims=4)
+    vectors = embedder.encode(FILMS)
+    terms = {doc['id']: np.array(doc['vector']) for batch in embedder.terms(batch_size=5)
+             for doc in batch}
+
+    assert set(terms) == {word for film in FILMS
+                          for word in tokenize(film['title']) + tokenize(film['description'])}
+    query = terms['dog']
+    best = np.argsort(-(vectors @ (query / np.linalg.norm(query))))[:2]
+    assert set(best) == {2, 3}
+
+
+def test_save_and_load(tmp_path):
+    embedder = TextEmbedder.fit(FILMS, buckets=256, dims=4)
+    path = str(tmp_path / 'embedding.npz')
+    embedder.save(path)
+    loaded = TextEmbedder.load(path)
+
+    assert np.array_equal(loaded.encode(FILMS), embedder.encode(FILMS))
+    assert list(loaded.vocabulary[0]) == list(embedder.vocabulary[0])
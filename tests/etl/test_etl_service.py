@@ -0,0 +1,27 @@
+import threading
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from etl_service import IndexWorker
+from postgresloader import NO_MARK
+from state import JsonFileStorage, State
+
+
+def worker(marks: dict) -> IndexWorker:
+    state = State(JsonFileStorage())
+    state.set_state('movies', marks)
+    return IndexWorker('movies', saver=None, state=state, stop=threading.Event(),
+                       poll_interval=1, max_interval=1)
+
+
+def test_lag_skips_empty_table_marks():
+    lag = worker({'film_work': '2021-06-16T20:14:09+00:00',
+                  'genre_film_work': NO_MARK})._lag()
+
+    assert lag is not None and lag > 0
+
+
+def test_lag_without_marks():
+    assert worker({'film_work': NO_MARK, 'person': None})._lag() is None
@@ -0,0 +1,77 @@
+from uuid import uuid4
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+from psycopg2.extras import DictCursor
+
+from config import dsl
+from load_data import remove_deleted
+from postgresloader import LoadMovies, LoadPerson
+
+
+@pytest.fixture
+def pg_conn():
+    """Соединение с базой из dump.sql; изменения откатываются"""
+    try:
+        conn = psycopg2.connect(**dsl, cursor_factory=DictCursor)
+    except psycopg2.OperationalError:
+        pytest.skip('Postgres с данными из dump.sql недоступен')
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+class Saver:
+    """Индекс из id документов: то, что remove_deleted спрашивает у EsSaver"""
+
+    def __init__(self, ids: set):
+        self.docs = set(ids)
+
+    def count(self, name_index: str) -> int:
+        return len(self.docs)
+
+    def ids(self, name_index: str):
+        return iter(sorted(self.docs))
+
+    def delete(self, ids, name_index: str) -> int:
+        ids = set(ids)
+        self.docs -= ids
+        return len(ids)
+
+
+def ids(conn, query) -> set:
+    with conn.cursor() as cursor:
+        cursor.execute(query)
+        return {str(row[0]) for row in cursor}
+
+
+def test_remove_deleted_drops_only_missing_rows(pg_conn):
+    present = ids(pg_conn, LoadPerson.ids_query)
+    gone = str(uuid4())
+    saver = Saver(present | {gone})
+
+    assert remove_deleted(pg_conn, saver, 'person') == 1
+    assert saver.docs == present
+
+
+def test_remove_deleted_skips_scan_when_counts_match(pg_conn):
+    saver = Saver(ids(pg_conn, LoadMovies.ids_query))
+    saver.ids = None
+
+    assert remove_deleted(pg_conn, saver, 'movies') == 0
+
+
+def test_chunks_include_rows_without_updated_at(pg_conn):
+    with pg_conn.cursor() as cursor:
+        cursor.execute('UPDATE content.film_work SET updated_at = NULL WHERE id IN '
+                       '(SELECT film_work_id FROM content.person_film_work LIMIT 5)')
+        cursor.execute('UPDATE content.film_work SET created_at = NULL, updated_at = NULL '
+                       'WHERE id IN (SELECT film_work_id FROM content.person_film_work '
+                       'ORDER BY film_work_id DESC LIMIT 5)')
+    loader = LoadMovies(pg_conn, batch_size=100)
+
+    loaded = [str(row['id']) for batch in loader.extract_chunks() for row in batch]
+
+    assert len(loaded) == len(set(loaded)) == loader.count(loader.query())
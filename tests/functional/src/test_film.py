@@ -19,7 +19,7 @@ async def test_general_film_list(make_get_request,
                                  redis_client):
     response = await make_get_request('film/')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:desc:None:0:20')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:desc:None:0:20')
     assert response.status == HTTPStatus.OK
     assert len(films) > 0
     assert cache
@@ -32,7 +32,7 @@ async def test_film_search_via_uuid(make_get_request, redis_client):
     film_uuid = film_list[0].id
     response = await make_get_request(f'film/{film_uuid}')
     film = await extract_film(response)
-    cache = await redis_client.get(f'movies:{film_uuid}')
+    cache = await redis_client.get(f'movies:Film:id:{film_uuid}')
     assert response_films.status == HTTPStatus.OK
     assert response.status == HTTPStatus.OK
     assert film.id == film_uuid
@@ -43,7 +43,7 @@ async def test_film_search_via_uuid(make_get_request, redis_client):
 async def test_film_list_asc_sorting(make_get_request, redis_client):
     response = await make_get_request('film/?sort=imdb_rating')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:asc:None:0:20')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:asc:None:0:20')
     assert response.status == HTTPStatus.OK
     assert len(films) > 1
     assert films[0].imdb_rating <= films[1].imdb_rating
@@ -54,7 +54,7 @@ async def test_film_list_asc_sorting(make_get_request, redis_client):
 async def test_film_list_desc_sorting(make_get_request, redis_client):
     response = await make_get_request('film/?sort=-imdb_rating')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:desc:None:0:20')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:desc:None:0:20')
     assert response.status == HTTPStatus.OK
     assert len(films) > 0
     assert films[0].imdb_rating >= films[1].imdb_rating
@@ -65,7 +65,7 @@ async def test_film_list_desc_sorting(make_get_request, redis_client):
 async def test_film_list_page_number(make_get_request, redis_client):
     response = await make_get_request('film/?page_number=0')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:desc:None:0:20')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:desc:None:0:20')
     assert response.status == HTTPStatus.OK
     assert len(films) > 0
     assert cache
@@ -75,7 +75,7 @@ async def test_film_list_page_number(make_get_request, redis_client):
 async def test_film_list_page_size(make_get_request, redis_client):
     response = await make_get_request('film/?page_size=10')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:desc:None:0:10')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:desc:None:0:10')
     assert response.status == HTTPStatus.OK
     assert len(films) > 0
     assert cache
@@ -85,7 +85,7 @@ async def test_film_list_page_size(make_get_request, redis_client):
 async def test_film_list_page_number_and_size(make_get_request, redis_client):
     response = await make_get_request('film/?page_size=9&page_number=0')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:desc:None:0:9')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:desc:None:0:9')
     assert response.status == HTTPStatus.OK
     assert len(films) > 0
     assert cache
@@ -97,7 +97,7 @@ async def test_film_page_number_and_size_sorted_asc(make_get_request,
     response = await make_get_request('film/?page_size=8&page_number=1'
                                       '&sort=imdb_rating')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:asc:None:1:8')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:asc:None:1:8')
     assert response.status == HTTPStatus.OK
     assert len(films) > 0
     assert films[0].imdb_rating <= films[1].imdb_rating
@@ -110,13 +110,51 @@ async def test_film_page_number_and_size_sorted_desc(make_get_request,
     response = await make_get_request('film/?page_size=7&page_number=2'
                                       '&sort=-imdb_rating')
     films = await extract_films(response)
-    cache = await redis_client.get('movies:imdb_rating:desc:None:2:7')
+    cache = await redis_client.get('movies:FilmShort:imdb_rating:desc:None:2:7')
     assert response.status == HTTPStatus.OK
     assert len(response.body) > 0
     assert films[0].imdb_rating >= films[1].imdb_rating
     assert cache
 
 
+@pytest.mark.asyncio
+async def test_film_list_cursor(make_get_request):
+    first = await make_get_request('film/', {'cursor': '', 'page_size': 1})
+    first_films = await extract_films(first)
+    cursor = first.headers.get('X-Next-Cursor')
+    second = await make_get_request('film/', {'cursor': cursor,
+                                              'page_size': 1})
+    second_films = await extract_films(second)
+    assert first.status == HTTPStatus.OK
+    assert second.status == HTTPStatus.OK
+    assert cursor
+    assert len(first_films) == len(second_films) == 1
+    assert first_films[0].id != second_films[0].id
+    assert first_films[0].imdb_rating >= second_films[0].imdb_rating
+
+
+@pytest.mark.asyncio
+async def test_film_list_invalid_page_size(make_get_request):
+    response = await make_get_request('film/', {'page_size': 0})
+    assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_film_list_invalid_cursor(make_get_request):
+    response = await make_get_request('film/', {'cursor': 'not-a-cursor'})
+    assert response.status == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_film_list_cursor_other_sort(make_get_request):
+    first = await make_get_request('film/', {'cursor': '', 'page_size': 1})
+    cursor = first.headers.get('X-Next-Cursor')
+    response = await make_get_request('film/', {'cursor': cursor,
+                                                'page_size': 1,
+                                                'sort': 'imdb_rating'})
+    assert response.status == HTTPStatus.BAD_REQUEST
+
+
 @pytest.mark.asyncio
 async def test_film_search(make_get_request, redis_client):
     response_films = await make_get_request('film/')
@@ -124,7 +162,7 @@ async def test_film_search(make_get_request, redis_client):
     film_title = film_list[0].title
     response = await make_get_request(f'film/search/{film_title}')
     search_films = await extract_films(response)
-    cache = await redis_client.get(f'movies:{film_title}')
+    cache = await redis_client.get(f'movies:FilmShort:search:{film_title}')
     assert response.status == HTTPStatus.OK
     assert len(search_films) > 0
     assert cache
@@ -136,7 +174,8 @@ async def test_film_popular_in_genre(make_get_request, redis_client):
         'film/genre/3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff')
     films = await extract_films(response)
     cache = await redis_client.get(
-        f'movies:3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff')
+        'movies:FilmShort:imdb_rating:desc:'
+        '3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff:0:30')
     assert response.status == HTTPStatus.OK
     assert len(films) > 0
     assert cache
@@ -156,7 +195,7 @@ async def test_film_alike(make_get_request, redis_client):
 async def test_es_uploading(make_get_request, redis_client):
     response = await make_get_request('film/some-test-id-0d757c7e4f59')
     film = await extract_film(response)
-    cache = await redis_client.get('movies:some-test-id-0d757c7e4f59')
+    cache = await redis_client.get('movies:Film:id:some-test-id-0d757c7e4f59')
     assert film.id == "some-test-id-0d757c7e4f59"
     assert film.title == "Test Star Trek III: The Search for Spock"
     assert cache
@@ -3,7 +3,8 @@ import pytest
 from http import HTTPStatus
 
 from functional.utils.models import Person
-from functional.utils.extract import extract_people, extract_person, extract_payload
+from functional.utils.extract import (extract_payload, extract_people,
+                                      extract_person, extract_person_films)
 
 
 @pytest.fixture(scope='session')
@@ -20,7 +21,7 @@ async def test_general_person_list(make_get_request,
                                    redis_client):
     response = await make_get_request('person/')
     people = await extract_people(response)
-    cache = await redis_client.get('person:None:None:None:0:20')
+    cache = await redis_client.get('person:PersonShort:None:None:None:0:20')
     assert response.status == HTTPStatus.OK
     assert len(people) > 0
     assert cache
@@ -33,7 +34,7 @@ async def test_person_search_via_uuid(make_get_request, redis_client):
     person_uuid = person_list[0].id
     response = await make_get_request(f'person/{person_uuid}')
     person = await extract_person(response)
-    cache = await redis_client.get(f'person:{person_uuid}')
+    cache = await redis_client.get(f'person:Person:id:{person_uuid}')
     assert response_people.status == HTTPStatus.OK
     assert response.status == HTTPStatus.OK
     assert person.id == person_uuid
@@ -44,7 +45,7 @@ async def test_person_search_via_uuid(make_get_request, redis_client):
 async def test_person_list_page_number(make_get_request, redis_client):
     response = await make_get_request('person/?page_number=0')
     people = await extract_people(response)
-    cache = await redis_client.get('person:None:None:None:0:20')
+    cache = await redis_client.get('person:PersonShort:None:None:None:0:20')
     assert response.status == HTTPStatus.OK
     assert len(people) > 0
     assert cache
@@ -54,7 +55,7 @@ async def test_person_list_page_number(make_get_request, redis_client):
 async def test_person_list_page_size(make_get_request, redis_client):
     response = await make_get_request('person/?page_size=9')
     people = await extract_people(response)
-    cache = await redis_client.get('person:None:None:None:0:9')
+    cache = await redis_client.get('person:PersonShort:None:None:None:0:9')
     assert response.status == HTTPStatus.OK
     assert (len(people) > 0) and (len(people) < 10)
     assert cache
@@ -65,7 +66,7 @@ async def test_person_list_page_number_and_size(make_get_request,
                                                 redis_client):
     response = await make_get_request('person/?page_size=8&page_number=0')
     people = await extract_people(response)
-    cache = await redis_client.get('person:None:None:None:0:8')
+    cache = await redis_client.get('person:PersonShort:None:None:None:0:8')
     assert response.status == HTTPStatus.OK
     assert (len(people) > 0) and (len(people) < 9)
     assert cache
@@ -78,7 +79,7 @@ async def test_person_search(make_get_request, redis_client):
     person_name = person_list[0].full_name
     response = await make_get_request(f'person/search/{person_name}')
     search_people = await extract_people(response)
-    cache = await redis_client.get(f'person:{person_name}')
+    cache = await redis_client.get(f'person:PersonShort:search:{person_name}')
     assert response.status == HTTPStatus.OK
     assert len(search_people) > 0
     assert cache
@@ -89,7 +90,26 @@ async def test_es_person_uploading(make_get_request, redis_client):
     response = await make_get_request(
         'person/test-person-b55c-45f6-9200-41f153a72a7a')
     person = await extract_person(response)
-    cache = await redis_client.get('person:test-person-b55c-45f6-9200-41f153a72a7a')
+    cache = await redis_client.get('person:Person:id:test-person-b55c-45f6-9200-41f153a72a7a')
     assert person.id == "test-person-b55c-45f6-9200-41f153a72a7a"
     assert person.full_name == "Test Jonathan Knight"
     assert cache
+
+
+@pytest.mark.asyncio
+async def test_person_films(make_get_request, redis_client):
+    response = await make_get_request(
+        'person/test-person-b55c-45f6-9200-41f153a72a7a/film')
+    films = await extract_person_films(response)
+    cache = await redis_client.get('person_films:test-person-b55c-45f6-9200-41f153a72a7a')
+    assert response.status == HTTPStatus.OK
+    assert [film.id for film in films] == ['7524f3a2-2f59-4e61-9c73-ad34484913d2']
+    assert films[0].role == 'director'
+    assert cache
+
+
+@pytest.mark.asyncio
+async def test_person_without_films(make_get_request):
+    response = await make_get_request(
+        'person/test-person-4c17-acc7-7c2ba092a337/film')
+    assert response.status == HTTPStatus.NOT_FOUND
@@ -26,7 +26,7 @@ async def test_search_movies(make_get_request, load_testing_movies_data, redis_c
 
     for i in response.body:
         assert 'dog' in i.get('title').lower()
-    data = await redis_client.get('movies:dog')
+    data = await redis_client.get('movies:FilmShort:search:dog')
     assert data
     assert 'dog' in data.decode('UTF-8').lower()
 
@@ -40,6 +40,6 @@ async def test_search_person(make_get_request, load_testing_person_data, redis_c
 
     for i in response.body:
         assert 'adam' in i.get('full_name').lower()
-    data = await redis_client.get('person:adam')
+    data = await redis_client.get('person:PersonShort:search:adam')
     assert data
     assert 'adam' in data.decode('UTF-8').lower()
@@ -2,7 +2,7 @@ import json
 
 from pydantic import BaseModel
 
-from functional.utils.models import FilmShort, Film, Person, HTTPResponse
+from functional.utils.models import FilmShort, Film, Person, PersonFilm, HTTPResponse
 
 
 async def extract_films(response: HTTPResponse) -> list[FilmShort]:
@@ -22,6 +22,10 @@ async def extract_person(response: HTTPResponse) -> Person:
     return Person.parse_obj(response.body)
 
 
+async def extract_person_films(response: HTTPResponse) -> list[PersonFilm]:
+    return [PersonFilm.parse_obj(film) for film in response.body]
+
+
 async def extract_payload(file_name: str,
                           model: BaseModel,
                           es_index: str) -> tuple:
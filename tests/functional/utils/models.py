@@ -32,12 +32,20 @@ class FilmShort(BaseModel):
     imdb_rating: Optional[float] = None
 
 
+class PersonFilm(BaseModel):
+    id: str
+    title: str
+    imdb_rating: Optional[float] = None
+    role: Optional[str] = None
+
+
 class Person(BaseModel):
     id: str
     full_name: str
     birth_date: Optional[date] = None
     role: Optional[str] = None
     film_ids: list[str]
+    films: Optional[list[PersonFilm]] = None
 
 
 class Genre(BaseModel):
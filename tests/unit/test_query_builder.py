@@ -0,0 +1,98 @@
+import json
+
+from services.query_builder import (QueryBuilder, QueryTemplate, SearchParams,
+                                    get_query_builder, param)
+
+
+def test_template_substitutes_only_params():
+    template = QueryTemplate({'query': {'term': {'id': param('id')}},
+                              'size': param('size')})
+    body = template.render(id='some "quoted" id', size=10)
+    assert json.loads(body) == {'query': {'term': {'id': 'some "quoted" id'}},
+                                'size': 10}
+
+
+def test_template_renders_lists_and_null():
+    template = QueryTemplate({'ids': param('ids'), 'pit': param('pit')})
+    assert json.loads(template.render(ids=['a', 'b'], pit=None)) == {
+        'ids': ['a', 'b'], 'pit': None}
+
+
+def test_search_query():
+    body = json.loads(QueryBuilder().search(SearchParams(
+        q='star', fields=['id', 'title'], source=['id', 'title'])))
+    assert body == {
+        'query': {'multi_match': {'query': 'star', 'fields': ['id', 'title']}},
+        '_source': ['id', 'title'],
+    }
+
+
+def test_sorted_page():
+    body = json.loads(QueryBuilder().search(SearchParams(
+        sort=[{'imdb_rating': 'desc'}], page_number=2, page_size=20)))
+    assert body == {
+        'query': {'match_all': {}},
+        'sort': [{'imdb_rating': 'desc'}],
+        'size': 20,
+        'from': 40,
+    }
+
+
+def test_genre_filter():
+    body = json.loads(QueryBuilder().search(SearchParams(
+        filter_genre='genre-id', page_number=0, page_size=30)))
+    assert body['query'] == {'bool': {'filter': [{'nested': {
+        'path': 'genre',
+        'query': {'term': {'genre.id': 'genre-id'}},
+    }}]}}
+    assert body['from'] == 0
+    assert body['size'] == 30
+
+
+def test_search_after_with_pit():
+    body = json.loads(QueryBuilder().search(SearchParams(
+        sort=[{'id': 'asc'}], page_size=10, search_after=['last-id'],
+        pit='pit-id', keep_alive='1m')))
+    assert body['search_after'] == ['last-id']
+    assert body['pit'] == {'id': 'pit-id', 'keep_alive': '1m'}
+    assert 'from' not in body
+
+
+def test_templates_are_compiled_once_per_shape():
+    builder = QueryBuilder()
+    builder.search(SearchParams(q='one', fields=['title']))
+    builder.search(SearchParams(q='two', fields=['title']))
+    builder.search(SearchParams(page_number=0, page_size=10))
+    assert len(builder._templates) == 2
+
+
+def test_alike_template():
+    body = json.loads(get_query_builder().render(
+        'alike', film_id='film', genre_ids=['a', 'b'], size=10,
+        source=['id']))
+    nested = body['query']['bool']['must'][0]['nested']
+    assert nested['query']['constant_score']['filter'] == {
+        'terms': {'genre.id': ['a', 'b']}}
+    assert body['query']['bool']['must_not'] == [{'ids': {'values': ['film']}}]
+    assert body['size'] == 10
+
+
+def test_vector_search():
+    body = json.loads(get_query_builder().render(
+        'vector', vector=[0.6, 0.8], source=['id', 'title']))
+    script = body['query']['script_score']['script']
+    assert body['query']['script_score']['query'] == {'match_all': {}}
+    assert script['params'] == {'vector': [0.6, 0.8]}
+    assert "dotProduct(params.vector, 'embedding')" in script['source']
+    assert body['_source'] == ['id', 'title']
+
+
+def test_hybrid_search():
+    body = json.loads(get_query_builder().render(
+        'hybrid', vector=[1.0, 0.0], q='star', fields=['title'], weight=5.0,
+        source=True))
+    query = body['query']['script_score']
+    assert query['query']['bool']['should'] == [
+        {'multi_match': {'query': 'star', 'fields': ['title']}}]
+    assert query['script']['params'] == {'vector': [1.0, 0.0], 'weight': 5.0}
+    assert query['script']['source'].startswith('_score + params.weight')